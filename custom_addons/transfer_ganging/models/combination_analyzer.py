@@ -1,7 +1,7 @@
 from odoo import models, fields, api
 import itertools
 import logging
-from .project_task import SHEET_W_MM, SHEET_H_MM, SHEET_AREA_MM2, get_size_dims_mm, SIZE_DIMS
+from .project_task import SHEET_W_MM, SHEET_H_MM, SHEET_AREA_MM2, get_size_dims_mm, SIZE_DIMS, SIZE_AREAS_MM2, get_fits_on_a3, layout_utilization
 
 _logger = logging.getLogger(__name__)
 
@@ -33,7 +33,7 @@ class CombinationAnalyzer(models.Model):
         for size in available_sizes:
             max_qty = self._get_fits_on_a3_single(size)
             item_w, item_h = get_size_dims_mm(size)
-            item_area = item_w * item_h
+            item_area = SIZE_AREAS_MM2[size]
             total_area = max_qty * item_area
             utilization = total_area / SHEET_AREA_MM2 if max_qty > 0 else 0
             
@@ -95,12 +95,12 @@ class CombinationAnalyzer(models.Model):
             else:
                 quantity_ranges[size] = [1, 2, 4, 8, max_for_size//2, max_for_size]
         
-        # Generate all combinations of quantities
-        size_qty_combinations = list(itertools.product(*[
+        # Generate combinations of quantities lazily - only the first 200 are ever tested
+        size_qty_combinations = itertools.product(*[
             [(size, qty) for qty in quantity_ranges[size]] for size in sizes
-        ]))
+        ])
         
-        for combo in size_qty_combinations[:200]:  # Limit to avoid too many combinations
+        for combo in itertools.islice(size_qty_combinations, 200):  # Limit to avoid too many combinations
             layout = {}
             for size, qty in combo:
                 layout[size] = qty
@@ -110,7 +110,7 @@ class CombinationAnalyzer(models.Model):
             if utilization > 0:  # Feasible combination
                 total_items = sum(layout.values())
                 total_area_used = sum(
-                    get_size_dims_mm(size)[0] * get_size_dims_mm(size)[1] * qty
+                    SIZE_AREAS_MM2[size] * qty
                     for size, qty in layout.items()
                 )
                 
@@ -130,69 +130,11 @@ class CombinationAnalyzer(models.Model):
     
     def _get_fits_on_a3_single(self, size):
         """Calculate how many items of given size fit on A3 sheet"""
-        if size == 'a3':
-            return 0  # A3 cannot be ganged
-        
-        item_w, item_h = get_size_dims_mm(size)
-        if item_w <= 0 or item_h <= 0:
-            return 0
-        
-        # Check if item fits at all
-        if item_w > SHEET_W_MM or item_h > SHEET_H_MM:
-            return 0
-        
-        # Calculate fit count - NO ROTATION, exact orientation only, no gutters
-        across = max(0, int(SHEET_W_MM // item_w))
-        down = max(0, int(SHEET_H_MM // item_h))
-        
-        return across * down
+        return get_fits_on_a3(size)
     
     def _calculate_template_utilization(self, layout):
         """Calculate utilization using no-rotation bin-packing - reuse from ganging engine"""
-        # Use simple shelf packing algorithm (no rotation allowed)
-        items_to_place = []
-        for size, quantity in layout.items():
-            item_w, item_h = get_size_dims_mm(size)
-            if item_w <= 0 or item_h <= 0:
-                return 0  # Invalid size
-            for _ in range(quantity):
-                items_to_place.append((item_w, item_h))
-        
-        # Sort items by height (tallest first) for better shelf packing
-        items_to_place.sort(key=lambda x: x[1], reverse=True)
-        
-        # Shelf packing without gutters (bleed included in crop dimensions)
-        gutter_x, gutter_y = 0, 0
-        shelves = []  # [(current_width, shelf_height)]
-        total_used_area = 0
-        
-        for item_w, item_h in items_to_place:
-            placed = False
-            
-            # Try to place on existing shelf
-            for i, (shelf_width, shelf_height) in enumerate(shelves):
-                # Check if item fits on this shelf
-                if (shelf_width + gutter_x + item_w <= SHEET_W_MM and 
-                    item_h <= shelf_height):
-                    shelves[i] = (shelf_width + gutter_x + item_w, shelf_height)
-                    total_used_area += item_w * item_h
-                    placed = True
-                    break
-            
-            if not placed:
-                # Create new shelf
-                new_shelf_y = sum(s[1] + gutter_y for s in shelves)
-                if new_shelf_y + item_h <= SHEET_H_MM and item_w <= SHEET_W_MM:
-                    shelves.append((item_w, item_h))
-                    total_used_area += item_w * item_h
-                    placed = True
-            
-            if not placed:
-                return 0  # Cannot fit all items
-        
-        # Calculate utilization based on placed area
-        utilization = total_used_area / SHEET_AREA_MM2
-        return utilization if utilization <= 1.0 else 0
+        return layout_utilization(tuple(layout.items()))
     
     def _get_layout_pattern(self, size, quantity):
         """Determine the layout pattern (e.g., '2×2', '4×1')"""
@@ -1,12 +1,229 @@
 from odoo import models, fields, api
+from array import array
+from collections import Counter, defaultdict, deque
+import heapq
 import logging
 
 # Import sheet dimensions and size mappings from project_task
 from . import project_task
-from .project_task import SHEET_W_MM, SHEET_H_MM, SHEET_AREA_MM2, get_size_dims_mm
+from .project_task import get_fits_on_a3, layout_utilization
 
 _logger = logging.getLogger(__name__)
 
+# Primary compatibility key per product type - LESS segregation for better consolidation:
+# zero transfers are grouped together instead of isolating each one, and ALL single colour
+# is grouped together initially (color mixing rules applied in combination logic)
+_COMPATIBILITY_GROUP_KEYS = {
+    'zero': "zero_group",
+    'full_colour': "full_colour",
+    'single_colour': "single_colour_group",
+    'metal': "metal",
+}
+
+# Stage name -> (row number, column letter ordinal); stage names are stable, so keys are parsed once per process
+_LAY_STAGE_KEYS = {}
+
+def _lay_stage_sort_key(name):
+    """Sort key for a LAY stage name: LAY-A1 to LAY-Z1, then LAY-A2 to LAY-Z2, unknown formats last"""
+    sort_key = _LAY_STAGE_KEYS.get(name)
+    if sort_key is None:
+        sort_key = (999, 999)  # Sort unknown formats to end
+        if 'LAY-' in name:
+            parts = name.split('-')
+            if len(parts) >= 2:
+                suffix = parts[1]
+                if len(suffix) >= 2:
+                    letter = suffix[0]
+                    number = suffix[1:]
+                    try:
+                        sort_key = (int(number), ord(letter.upper()))
+                    except (ValueError, TypeError):
+                        pass
+        _LAY_STAGE_KEYS[name] = sort_key
+    return sort_key
+
+def _score_templates(template_needs, template_priorities, template_utilizations, size_totals, size_qtys, size_priorities):
+    """
+    Scoring pass over layout templates (no ORM access) - returns the index of the best feasible template, or -1
+    
+    template_needs[i] is a Counter of size -> qty_needed for template i and size_totals a Counter of the
+    available quantity per size. size_qtys[size] and size_priorities[size] list the available quantity
+    and priority of each task of that size, highest priority first, so each template is filled greedily
+    from the most urgent tasks.
+    """
+    best_index = -1
+    best_score = 0
+    # Templates share (size, qty_needed) slots, so each greedy fill is computed once per call
+    fills = {}  # (size, qty_needed) -> (priority-weighted quantity, quantity allocated)
+    
+    for i in range(len(template_needs)):
+        # Check if we have enough quantity for this template - the Counter difference only
+        # keeps sizes we are short of, so an empty result means the template fits
+        if template_needs[i] - size_totals:
+            continue
+        
+        total_task_priority = 0
+        total_items = 0
+        for size, qty_needed in template_needs[i].items():
+            fill = fills.get((size, qty_needed))
+            if fill is None:
+                qtys = size_qtys[size]
+                priorities = size_priorities[size]
+                weighted_priority = 0
+                qty_allocated = 0
+                for j in range(len(qtys)):
+                    if qty_allocated >= qty_needed:
+                        break
+                    
+                    qty_to_take = qty_needed - qty_allocated
+                    if qtys[j] < qty_to_take:
+                        qty_to_take = qtys[j]
+                    weighted_priority += priorities[j] * qty_to_take
+                    qty_allocated += qty_to_take
+                fill = fills[(size, qty_needed)] = (weighted_priority, qty_allocated)
+            total_task_priority += fill[0]
+            total_items += fill[1]
+        
+        if total_items > 0:
+            avg_task_priority = total_task_priority / total_items
+            
+            # Enhanced weighted scoring system favoring consolidation
+            score = (template_priorities[i] * 300 +        # Reduced template priority weight
+                     template_utilizations[i] * 2000 +     # DOUBLED sheet utilization weight
+                     avg_task_priority * 25 +              # Increased task urgency weight
+                     total_items * 8)                      # INCREASED item count bonus for consolidation
+            
+            if score > best_score:
+                best_index = i
+                best_score = score
+    
+    return best_index
+
+# Comprehensive mixed-size layout templates prioritizing sheet utilization (physically verified combinations)
+MIXED_LAYOUT_TEMPLATES = [
+    # Ultra high-efficiency combinations (90%+ utilization) - PRIORITIZED
+    {
+        'name': '1×A4 + 1×A5 + 4×100x70',
+        'layout': {'a4': 1, 'a5': 1, '100x70': 4},
+        'description': 'Optimal mixed medium sizes',
+        'priority': 15,  # INCREASED priority for high utilization
+        'utilization': 0.92  # Added utilization for scoring
+    },
+    {
+        'name': '2×A5 + 2×A6 + 4×100x70',
+        'layout': {'a5': 2, 'a6': 2, '100x70': 4},
+        'description': 'High density small-medium mix',
+        'priority': 15,  # INCREASED priority for high utilization
+        'utilization': 0.90  # Added utilization for scoring
+    },
+    {
+        'name': '1×A4 + 2×A6 + 8×100x70',
+        'layout': {'a4': 1, 'a6': 2, '100x70': 8},
+        'description': 'Maximum 100x70 density with A4',
+        'priority': 14  # INCREASED priority
+    },
+    
+    # High-efficiency single size runs (85%+ utilization)
+    {
+        'name': '2×A4 only',
+        'layout': {'a4': 2},
+        'description': 'Pure A4 efficiency',
+        'priority': 8
+    },
+    {
+        'name': '4×A5 only',
+        'layout': {'a5': 4},
+        'description': 'Pure A5 efficiency',
+        'priority': 8
+    },
+    {
+        'name': '8×A6 only',
+        'layout': {'a6': 8},
+        'description': 'Pure A6 efficiency',
+        'priority': 8
+    },
+    
+    # Medium efficiency mixed combinations (70-85% utilization)
+    {
+        'name': '1×A5 + 3×A6 + 6×100x70',
+        'layout': {'a5': 1, 'a6': 3, '100x70': 6},
+        'description': 'Balanced small size mix',
+        'priority': 7
+    },
+    {
+        'name': '1×A4 + 6×95x95',
+        'layout': {'a4': 1, '95x95': 6},
+        'description': 'A4 with square formats',
+        'priority': 7
+    },
+    {
+        'name': '2×A5 + 8×95x95',
+        'layout': {'a5': 2, '95x95': 8},
+        'description': 'A5 with square formats',
+        'priority': 7
+    },
+    {
+        'name': '1×295x100 + 2×A6 + 6×60x60',
+        'layout': {'295x100': 1, 'a6': 2, '60x60': 6},
+        'description': 'Large format with small items',
+        'priority': 6
+    },
+    {
+        'name': '1×290x140 + 1×A6 + 4×100x70',
+        'layout': {'290x140': 1, 'a6': 1, '100x70': 4},
+        'description': 'Large format mixed',
+        'priority': 6
+    },
+    
+    # Small format high-density options - BOOSTED for consolidation
+    {
+        'name': 'Max 100x70 only',
+        'layout': {'100x70': 40},  # Will be calculated by fit algorithm
+        'description': 'Maximum small format density',
+        'priority': 12,  # INCREASED for better consolidation
+        'utilization': 0.88  # Added utilization for scoring
+    },
+    {
+        'name': 'Max 95x95 only',
+        'layout': {'95x95': 28},  # Will be calculated by fit algorithm  
+        'description': 'Maximum square format density',
+        'priority': 12  # INCREASED for better consolidation
+    },
+    {
+        'name': 'Max 60x60 only',
+        'layout': {'60x60': 72},  # Will be calculated by fit algorithm
+        'description': 'Maximum tiny format density',
+        'priority': 11  # INCREASED for better consolidation
+    },
+    
+    # Specialty combinations for unusual mixes
+    {
+        'name': '2×295x100 only',
+        'layout': {'295x100': 2},
+        'description': 'Large format pair',
+        'priority': 5
+    },
+    {
+        'name': '1×A4 + 1×A6 + 2×295x100',
+        'layout': {'a4': 1, 'a6': 1, '295x100': 2},
+        'description': 'Mixed with large formats',
+        'priority': 5
+    }
+]
+
+def _build_feasible_templates():
+    """Calculate dynamic utilization and filter feasible templates"""
+    feasible_templates = []
+    for template in MIXED_LAYOUT_TEMPLATES:
+        utilization = layout_utilization(tuple(template['layout'].items()))
+        if utilization > 0 and utilization <= 1.0:  # Must be physically feasible
+            # Own layout dict, so the feasible templates never share state with MIXED_LAYOUT_TEMPLATES
+            feasible_templates.append(dict(template, layout=dict(template['layout']), utilization=utilization))
+    return feasible_templates
+
+# Layouts and sheet dimensions never change at runtime, so template packing runs once at import
+FEASIBLE_MIXED_TEMPLATES = _build_feasible_templates()
+
 class TransferGangingEngine(models.Model):
     _name = 'transfer.ganging.engine'
     _description = 'Transfer Ganging Optimization Engine'
@@ -28,25 +245,43 @@ class TransferGangingEngine(models.Model):
             return {'type': 'ir.actions.client', 'tag': 'display_notification',
                    'params': {'message': 'No tasks to analyze', 'type': 'warning'}}
         
+        # The parsers read stored fields record by record; the first access prefetches them for the whole
+        # set in one query (no read(), which would also name_get every stage and project)
+        # LAY membership is tested against stage ids, so stage names never need loading per task
+        lay_stage_ids = self.env['project.task']._get_lay_stage_ids()
+        
         # Initialize per-run allocation tracking AND LAY mapping
-        run_allocations = {}  # task.id -> total_allocated_qty
-        lay_assignments = {}  # lay_stage_id -> list of {'task_id': task.id, 'quantity': qty}
+        # Tasks get a dense slot 0..N-1 so allocations and remaining quantities live in flat int arrays
+        task_index = {task.id: idx for idx, task in enumerate(tasks)}  # task.id -> slot
+        run_allocations = array('i', [0]) * len(task_index)  # slot -> total_allocated_qty
+        remaining_qtys = array('i', [0]) * len(task_index)  # slot -> remaining qty at start of run
+        gang_priorities = array('i', [0]) * len(task_index)  # slot -> gang priority, fixed for the run
+        today = fields.Date.today()  # One deadline reference date for the whole run
+        gang_costs_by_project = {}  # project id -> (A3 sheet cost, screen cost), read once per project
         for task in tasks:
-            run_allocations[task.id] = 0
+            gang_costs = gang_costs_by_project.get(task.project_id.id)
+            if gang_costs is None:
+                gang_costs = gang_costs_by_project[task.project_id.id] = task._get_gang_costs()
+            remaining_qtys[task_index[task.id]] = task.get_remaining_quantity(lay_stage_ids)
+            gang_priorities[task_index[task.id]] = task.get_gang_priority(today, gang_costs)
+        lay_assignments = {}  # lay_stage_id -> list of {'task_id': task.id, 'quantity': qty}
         
         total_allocated_qty = 0
-        total_remaining_qty = sum(task.get_remaining_quantity() for task in tasks)
+        # Remaining quantity is parsed per task (not stored), so aggregate the per-run column instead of re-reading the ORM
+        total_remaining_qty = sum(remaining_qtys)
         
         # Group tasks by compatibility
         compatibility_groups = self._group_by_compatibility(tasks)
         
         # Find available LAY columns
-        lay_stages = self._get_lay_stages()
+        # Columns are handed out from the front and shared by the primary and cross-compatibility passes
+        lay_stages = deque(self._get_lay_stages())
         
         # Process primary compatibility groups first (like-with-like)
         unprocessed_groups = {}
         for group_key, group_tasks in compatibility_groups.items():
-            result = self._process_compatibility_group(group_tasks, lay_stages, run_allocations, lay_assignments)
+            result = self._process_compatibility_group(group_tasks, lay_stages, run_allocations, lay_assignments,
+                                                       task_index, remaining_qtys, gang_priorities)
             total_allocated_qty += result['allocated_qty']
             
             # Keep track of groups with remaining unprocessed tasks
@@ -55,11 +290,13 @@ class TransferGangingEngine(models.Model):
         
         # Try cross-compatibility ganging for remaining unprocessed tasks
         if unprocessed_groups and lay_stages:
-            cross_result = self._process_cross_compatibility(unprocessed_groups, lay_stages, run_allocations, lay_assignments)
+            cross_result = self._process_cross_compatibility(unprocessed_groups, lay_stages, run_allocations, lay_assignments,
+                                                             task_index, remaining_qtys, gang_priorities)
             total_allocated_qty += cross_result['allocated_qty']
         
         # Final cleanup: move fully consumed tasks to LAY stages using LAY assignments
-        fully_ganged_count = self._finalize_task_assignments_with_lay_mapping(run_allocations, lay_assignments)
+        fully_ganged_count = self._finalize_task_assignments_with_lay_mapping(run_allocations, lay_assignments,
+                                                                              task_index, remaining_qtys, lay_stage_ids)
         
         remaining_qty = total_remaining_qty - total_allocated_qty
         message = f"Analysis complete: {total_allocated_qty} items allocated across {fully_ganged_count} tasks, {remaining_qty} items left for future opportunities"
@@ -74,36 +311,18 @@ class TransferGangingEngine(models.Model):
     
     def _group_by_compatibility(self, tasks):
         """Group tasks by product type and color compatibility - prioritize like-with-like first"""
-        groups = {}
+        groups = defaultdict(list)
         
         for task in tasks:
-            # Use parsing methods instead of custom fields
-            product_type = task.get_parsed_product_type()
-            color_variant = task.get_parsed_color_variant()
-            
-            # Create primary compatibility key - LESS segregation for better consolidation
-            if product_type == 'zero':
-                # Group zero transfers together instead of isolating each one
-                key = "zero_group"
-            elif product_type == 'full_colour':
-                # Full colour gets its own primary group  
-                key = "full_colour"
-            elif product_type == 'single_colour':
-                # Group ALL single colour together initially - color mixing rules applied in combination logic
-                key = "single_colour_group"
-            elif product_type == 'metal':
-                # Metal gets its own group
-                key = "metal"
-            else:
-                key = "unknown_group"
-            
-            if key not in groups:
-                groups[key] = []
+            # Use parsing methods instead of custom fields - the primary key only depends on product type,
+            # color mixing rules are applied later in combination logic
+            key = _COMPATIBILITY_GROUP_KEYS.get(task.get_parsed_product_type(), "unknown_group")
             groups[key].append(task)
         
-        return groups
+        return dict(groups)
     
-    def _process_compatibility_group(self, tasks, lay_stages, run_allocations, lay_assignments):
+    def _process_compatibility_group(self, tasks, lay_stages, run_allocations, lay_assignments, task_index, remaining_qtys,
+                                     gang_priorities):
         """Process a group of compatible tasks with better consolidation"""
         allocated_qty = 0
         ganged_count = 0
@@ -111,10 +330,12 @@ class TransferGangingEngine(models.Model):
         
         # Sort by priority (deadline urgency + cost effectiveness)
         # Note: Mixed deadlines are allowed - priority is just for processing order
-        sorted_tasks = sorted(tasks, key=lambda t: t.get_gang_priority(), reverse=True)
+        sorted_tasks = sorted(tasks, key=lambda t: gang_priorities[task_index[t.id]], reverse=True)
         
         # Try to find optimal ganging combinations with consolidation
+        # Membership is tracked by id; the ordered list is rebuilt once per sheet, not per item
         remaining_tasks = list(sorted_tasks)
+        remaining_ids = {t.id for t in tasks}
         
         # Consolidation logic: Process multiple A3 sheets per LAY column
         current_lay_stage = None
@@ -123,7 +344,8 @@ class TransferGangingEngine(models.Model):
         
         while remaining_tasks and lay_stages:
             # Find best combination for one A3 sheet - pass run_allocations to prevent over-allocation
-            best_combination = self._find_best_a3_combination(remaining_tasks, run_allocations)
+            best_combination = self._find_best_a3_combination(remaining_tasks, run_allocations, task_index, remaining_qtys,
+                                                              gang_priorities)
             
             if not best_combination:
                 # No good combinations found, leave remaining unplanned
@@ -131,12 +353,12 @@ class TransferGangingEngine(models.Model):
                 break
             
             # Check if this combination is cost-effective or has urgent deadlines
-            should_gang = self._should_gang_combination(best_combination)
+            should_gang = self._should_gang_combination(best_combination, task_index, gang_priorities)
             
             if should_gang:
                 # Consolidation logic: Use current LAY stage if available, otherwise get new one
                 if current_lay_stage is None or sheets_in_current_lay >= max_sheets_per_lay:
-                    current_lay_stage = lay_stages.pop(0) if lay_stages else None
+                    current_lay_stage = lay_stages.popleft() if lay_stages else None
                     sheets_in_current_lay = 0
                     # Initialize LAY assignment tracking for this stage
                     if current_lay_stage and current_lay_stage.id not in lay_assignments:
@@ -151,7 +373,8 @@ class TransferGangingEngine(models.Model):
                             quantity = item['quantity']
                             
                             # Track allocated quantity AND LAY assignment
-                            run_allocations[task.id] += quantity
+                            task_idx = task_index[task.id]
+                            run_allocations[task_idx] += quantity
                             allocated_in_template += quantity
                             
                             # Record LAY assignment for this task
@@ -161,17 +384,18 @@ class TransferGangingEngine(models.Model):
                             })
                             
                             # Mark for removal if fully consumed, but don't set stage yet
-                            if run_allocations[task.id] >= task.get_remaining_quantity():
-                                if task in remaining_tasks:
+                            if run_allocations[task_idx] >= remaining_qtys[task_idx]:
+                                if task.id in remaining_ids:
                                     tasks_to_remove.append(task)
                         else:
                             # Backward compatibility for simple task list - don't set stage directly!
                             # Record LAY assignment and track for removal
-                            if item in remaining_tasks:
+                            if item.id in remaining_ids:
                                 # Calculate available quantity considering prior allocations
-                                already_allocated = run_allocations.get(item.id, 0)
-                                available_qty = max(0, item.get_remaining_quantity() - already_allocated)
-                                quantity = min(available_qty, item.get_remaining_quantity())
+                                item_idx = task_index[item.id]
+                                already_allocated = run_allocations[item_idx]
+                                available_qty = remaining_qtys[item_idx] - already_allocated
+                                quantity = available_qty if available_qty > 0 else 0
                                 
                                 if quantity > 0:
                                     # Record LAY assignment for this task
@@ -180,16 +404,18 @@ class TransferGangingEngine(models.Model):
                                         'quantity': quantity
                                     })
                                     # Accumulate allocation (don't overwrite)
-                                    run_allocations[item.id] += quantity
+                                    run_allocations[item_idx] += quantity
                                 allocated_in_template += quantity
                                 
                                 # Only remove if fully consumed for better consolidation
-                                if run_allocations[item.id] >= item.get_remaining_quantity():
+                                if run_allocations[item_idx] >= remaining_qtys[item_idx]:
                                     tasks_to_remove.append(item)
                     
                     # Remove tasks that were fully consumed
                     for task in tasks_to_remove:
-                        remaining_tasks.remove(task)
+                        remaining_ids.discard(task.id)
+                    if tasks_to_remove:
+                        remaining_tasks = [t for t in remaining_tasks if t.id in remaining_ids]
                     
                     # Update tracking totals and sheet count
                     allocated_qty += allocated_in_template
@@ -203,14 +429,14 @@ class TransferGangingEngine(models.Model):
                 critical_items = []
                 for item in best_combination:
                     task = item['task'] if isinstance(item, dict) else item
-                    if task.get_gang_priority() >= 100:
+                    if gang_priorities[task_index[task.id]] >= 100:
                         critical_items.append(item)
                 
                 if critical_items:
                     # Gang critical tasks even if not cost-effective
                     # Use consolidation logic for critical tasks too
                     if current_lay_stage is None or sheets_in_current_lay >= max_sheets_per_lay:
-                        current_lay_stage = lay_stages.pop(0) if lay_stages else None
+                        current_lay_stage = lay_stages.popleft() if lay_stages else None
                         sheets_in_current_lay = 0
                         # Initialize LAY assignment tracking for this stage
                         if current_lay_stage and current_lay_stage.id not in lay_assignments:
@@ -223,7 +449,8 @@ class TransferGangingEngine(models.Model):
                                 task = item['task']
                                 quantity = item['quantity']
                                 # Track allocation AND LAY assignment for critical items
-                                run_allocations[task.id] += quantity
+                                task_idx = task_index[task.id]
+                                run_allocations[task_idx] += quantity
                                 allocated_in_critical += quantity
                                 
                                 # Record LAY assignment for critical item
@@ -232,16 +459,17 @@ class TransferGangingEngine(models.Model):
                                     'quantity': quantity
                                 })
                                 
-                                if run_allocations[task.id] >= task.get_remaining_quantity():
-                                    if task in remaining_tasks:
+                                if run_allocations[task_idx] >= remaining_qtys[task_idx]:
+                                    if task.id in remaining_ids:
                                         tasks_to_remove.append(task)
                             else:
                                 # Record LAY assignment with proper allocation accounting
-                                if item in remaining_tasks:
+                                if item.id in remaining_ids:
                                     # Calculate available quantity considering prior allocations
-                                    already_allocated = run_allocations.get(item.id, 0)
-                                    available_qty = max(0, item.get_remaining_quantity() - already_allocated)
-                                    quantity = min(available_qty, item.get_remaining_quantity())
+                                    item_idx = task_index[item.id]
+                                    already_allocated = run_allocations[item_idx]
+                                    available_qty = remaining_qtys[item_idx] - already_allocated
+                                    quantity = available_qty if available_qty > 0 else 0
                                     
                                     if quantity > 0:
                                         lay_assignments[current_lay_stage.id].append({
@@ -249,16 +477,18 @@ class TransferGangingEngine(models.Model):
                                             'quantity': quantity
                                         })
                                         # CRITICAL FIX: Accumulate allocation (don't overwrite)
-                                        run_allocations[item.id] += quantity
+                                        run_allocations[item_idx] += quantity
                                         allocated_in_critical += quantity
                                     
                                     # Only remove if fully consumed for better consolidation
-                                    if run_allocations[item.id] >= item.get_remaining_quantity():
+                                    if run_allocations[item_idx] >= remaining_qtys[item_idx]:
                                         tasks_to_remove.append(item)
                         
                         # Remove tasks that were fully consumed
                         for task in tasks_to_remove:
-                            remaining_tasks.remove(task)
+                            remaining_ids.discard(task.id)
+                        if tasks_to_remove:
+                            remaining_tasks = [t for t in remaining_tasks if t.id in remaining_ids]
                         
                         # Update tracking totals and sheet count
                         allocated_qty += allocated_in_critical
@@ -274,7 +504,8 @@ class TransferGangingEngine(models.Model):
             'remaining_tasks': remaining_tasks
         }
     
-    def _process_cross_compatibility(self, unprocessed_groups, lay_stages, run_allocations, lay_assignments):
+    def _process_cross_compatibility(self, unprocessed_groups, lay_stages, run_allocations, lay_assignments, task_index, remaining_qtys,
+                                     gang_priorities):
         """Process cross-compatibility ganging for remaining tasks with consolidation logic"""
         allocated_qty = 0
         ganged_count = 0
@@ -290,14 +521,15 @@ class TransferGangingEngine(models.Model):
         for pool_tasks in compatible_pools:
             while pool_tasks and lay_stages:
                 # Find best cross-compatibility combination focusing on size optimization - pass run_allocations
-                best_combination = self._find_best_cross_compatible_combination(pool_tasks, run_allocations)
+                best_combination = self._find_best_cross_compatible_combination(pool_tasks, run_allocations, task_index, remaining_qtys,
+                                                                                gang_priorities)
                 
-                if not best_combination or not self._should_gang_combination(best_combination):
+                if not best_combination or not self._should_gang_combination(best_combination, task_index, gang_priorities):
                     break
                 
                 # Use consolidation logic: reuse current LAY stage or get new one
                 if current_lay_stage is None or sheets_in_current_lay >= max_sheets_per_lay:
-                    current_lay_stage = lay_stages.pop(0) if lay_stages else None
+                    current_lay_stage = lay_stages.popleft() if lay_stages else None
                     sheets_in_current_lay = 0
                     # Initialize LAY assignment tracking for this stage
                     if current_lay_stage and current_lay_stage.id not in lay_assignments:
@@ -312,7 +544,8 @@ class TransferGangingEngine(models.Model):
                             quantity = item['quantity']
                             
                             # Track allocated quantity AND LAY assignment
-                            run_allocations[task.id] += quantity
+                            task_idx = task_index[task.id]
+                            run_allocations[task_idx] += quantity
                             allocated_in_template += quantity
                             
                             # Record LAY assignment for this task
@@ -322,14 +555,15 @@ class TransferGangingEngine(models.Model):
                             })
                             
                             # Don't set stage directly - let finalization handle it
-                            if run_allocations[task.id] >= task.get_remaining_quantity():
+                            if run_allocations[task_idx] >= remaining_qtys[task_idx]:
                                 tasks_to_remove.append(task)
                         else:
                             # Backward compatibility - don't set stage directly
                             # Calculate available quantity and record LAY assignment
-                            already_allocated = run_allocations.get(item.id, 0)
-                            available_qty = max(0, item.get_remaining_quantity() - already_allocated)
-                            quantity = min(available_qty, item.get_remaining_quantity())
+                            item_idx = task_index[item.id]
+                            already_allocated = run_allocations[item_idx]
+                            available_qty = remaining_qtys[item_idx] - already_allocated
+                            quantity = available_qty if available_qty > 0 else 0
                             
                             if quantity > 0:
                                 lay_assignments[current_lay_stage.id].append({
@@ -337,11 +571,11 @@ class TransferGangingEngine(models.Model):
                                     'quantity': quantity
                                 })
                                 # Accumulate allocation (don't overwrite)
-                                run_allocations[item.id] += quantity
+                                run_allocations[item_idx] += quantity
                             allocated_in_template += quantity
                             
                             # Only remove if fully consumed for better consolidation
-                            if run_allocations[item.id] >= item.get_remaining_quantity():
+                            if run_allocations[item_idx] >= remaining_qtys[item_idx]:
                                 tasks_to_remove.append(item)
                     
                     # Remove tasks that were fully consumed from original groups
@@ -389,30 +623,38 @@ class TransferGangingEngine(models.Model):
         
         return pools
     
-    def _find_best_cross_compatible_combination(self, tasks, run_allocations=None):
+    def _find_best_cross_compatible_combination(self, tasks, run_allocations=None, task_index=None, remaining_qtys=None,
+                                                gang_priorities=None):
         """Find best combination across compatible task types focusing on size optimization"""
         if not tasks:
             return []
             
         # Use the same logic as regular combination finding but with cross-compatible tasks
-        return self._find_best_a3_combination(tasks, run_allocations)
+        return self._find_best_a3_combination(tasks, run_allocations, task_index, remaining_qtys, gang_priorities)
     
-    def _find_best_a3_combination(self, tasks, run_allocations=None):
+    def _find_best_a3_combination(self, tasks, run_allocations=None, task_index=None, remaining_qtys=None, gang_priorities=None):
         """Find the best mixed-size combination using predefined layout templates, accounting for prior allocations"""
         if not tasks:
             return []
         
         # Initialize run_allocations if not provided (for backward compatibility)
         if run_allocations is None:
-            run_allocations = {}
+            task_index = {task.id: idx for idx, task in enumerate(tasks)}
+            run_allocations = array('i', [0]) * len(task_index)
+            remaining_qtys = array('i', [task.get_remaining_quantity() for task in tasks])
+        if gang_priorities is None:
+            gang_priorities = array('i', [0]) * len(task_index)
+            today = fields.Date.today()
+            for task in tasks:
+                gang_priorities[task_index[task.id]] = task.get_gang_priority(today)
         
         # Handle A3 size separately - cannot be ganged
         a3_tasks = [t for t in tasks if t.get_parsed_transfer_size() == 'a3']
         if a3_tasks:
             # Find A3 task with available quantity
-            for task in sorted(a3_tasks, key=lambda t: t.get_gang_priority(), reverse=True):
-                already_allocated = run_allocations.get(task.id, 0)
-                available_qty = max(0, task.get_remaining_quantity() - already_allocated)
+            for task in sorted(a3_tasks, key=lambda t: gang_priorities[task_index[t.id]], reverse=True):
+                task_idx = task_index[task.id]
+                available_qty = remaining_qtys[task_idx] - run_allocations[task_idx]
                 if available_qty >= 1:
                     return [{'task': task, 'quantity': 1}]
             return []  # No A3 tasks with available quantity
@@ -421,8 +663,8 @@ class TransferGangingEngine(models.Model):
         available_tasks = {}
         for task in tasks:
             size = task.get_parsed_transfer_size()
-            already_allocated = run_allocations.get(task.id, 0)
-            available_qty = max(0, task.get_remaining_quantity() - already_allocated)
+            task_idx = task_index[task.id]
+            available_qty = remaining_qtys[task_idx] - run_allocations[task_idx]
             
             if size != 'a3' and available_qty > 0:
                 if size not in available_tasks:
@@ -430,249 +672,67 @@ class TransferGangingEngine(models.Model):
                 available_tasks[size].append({
                     'task': task,
                     'remaining_qty': available_qty,  # Use available, not remaining
-                    'priority': task.get_gang_priority()
+                    'priority': gang_priorities[task_idx]
                 })
         
         if not available_tasks:
             return []
         
+        # Flatten the per-size inventory, highest priority first, for the scoring pass
+        size_totals = Counter()
+        size_qtys = {}
+        size_priorities = {}
+        for size, task_list in available_tasks.items():
+            task_list.sort(key=lambda x: -x['priority'])
+            size_qtys[size] = [t['remaining_qty'] for t in task_list]
+            size_priorities[size] = [t['priority'] for t in task_list]
+            size_totals[size] = sum(size_qtys[size])
+        
         # Define proven mixed-size layout templates (physically verified combinations)
         layout_templates = self._get_mixed_layout_templates()
         
-        best_combination = []
-        best_score = 0
-        
         # Sort templates by priority first, then try them
         sorted_templates = sorted(layout_templates, key=lambda t: t.get('priority', 0), reverse=True)
         
-        # Try each template starting with highest priority
-        for template in sorted_templates:
-            combination = []
-            total_task_priority = 0
-            total_items = 0
-            template_feasible = True
-            
-            # Check if we have enough tasks for this template
-            for size, qty_needed in template['layout'].items():
-                if size not in available_tasks:
-                    template_feasible = False
-                    break
-                
-                # Sort tasks by priority for this size
-                sorted_tasks = sorted(available_tasks[size], key=lambda x: -x['priority'])
-                qty_available = sum(t['remaining_qty'] for t in sorted_tasks)
-                
-                if qty_available < qty_needed:
-                    template_feasible = False
-                    break
-                
-                # Allocate from highest priority tasks
-                qty_allocated = 0
-                for task_item in sorted_tasks:
-                    if qty_allocated >= qty_needed:
-                        break
-                    
-                    qty_to_take = min(task_item['remaining_qty'], qty_needed - qty_allocated)
-                    if qty_to_take > 0:
-                        combination.append({
-                            'task': task_item['task'],
-                            'quantity': qty_to_take
-                        })
-                        total_task_priority += task_item['priority'] * qty_to_take
-                        total_items += qty_to_take
-                        qty_allocated += qty_to_take
-            
-            if template_feasible and combination:
-                # Enhanced scoring: template priority, utilization, task priority, and completeness
-                utilization = template.get('utilization', 0.0)  # Defensive coding for missing utilization
-                template_priority = template.get('priority', 1)
-                avg_task_priority = total_task_priority / total_items if total_items > 0 else 0
-                
-                # Enhanced weighted scoring system favoring consolidation
-                score = (template_priority * 300 +           # Reduced template priority weight
-                        utilization * 2000 +                # DOUBLED sheet utilization weight
-                        avg_task_priority * 25 +             # Increased task urgency weight
-                        total_items * 8)                     # INCREASED item count bonus for consolidation
-                
-                if score > best_score:
-                    best_combination = combination
-                    best_score = score
+        best_index = _score_templates(
+            [Counter(template['layout']) for template in sorted_templates],
+            [template.get('priority', 1) for template in sorted_templates],
+            [template.get('utilization', 0.0) for template in sorted_templates],  # Defensive coding for missing utilization
+            size_totals, size_qtys, size_priorities,
+        )
         
         # Fallback to single-size combinations if no mixed templates work
-        if not best_combination:
+        if best_index < 0:
             return self._find_single_size_combination(available_tasks)
         
+        # Build the winning combination, allocating from highest priority tasks
+        best_combination = []
+        for size, qty_needed in sorted_templates[best_index]['layout'].items():
+            qty_allocated = 0
+            for task_item in available_tasks[size]:
+                if qty_allocated >= qty_needed:
+                    break
+                
+                qty_to_take = qty_needed - qty_allocated
+                if task_item['remaining_qty'] < qty_to_take:
+                    qty_to_take = task_item['remaining_qty']
+                best_combination.append({
+                    'task': task_item['task'],
+                    'quantity': qty_to_take
+                })
+                qty_allocated += qty_to_take
+        
         return best_combination
     
     def _get_mixed_layout_templates(self):
         """Define comprehensive mixed-size layout templates prioritizing sheet utilization"""
-        templates = [
-            # Ultra high-efficiency combinations (90%+ utilization) - PRIORITIZED
-            {
-                'name': '1×A4 + 1×A5 + 4×100x70',
-                'layout': {'a4': 1, 'a5': 1, '100x70': 4},
-                'description': 'Optimal mixed medium sizes',
-                'priority': 15,  # INCREASED priority for high utilization
-                'utilization': 0.92  # Added utilization for scoring
-            },
-            {
-                'name': '2×A5 + 2×A6 + 4×100x70',
-                'layout': {'a5': 2, 'a6': 2, '100x70': 4},
-                'description': 'High density small-medium mix',
-                'priority': 15,  # INCREASED priority for high utilization
-                'utilization': 0.90  # Added utilization for scoring
-            },
-            {
-                'name': '1×A4 + 2×A6 + 8×100x70',
-                'layout': {'a4': 1, 'a6': 2, '100x70': 8},
-                'description': 'Maximum 100x70 density with A4',
-                'priority': 14  # INCREASED priority
-            },
-            
-            # High-efficiency single size runs (85%+ utilization)
-            {
-                'name': '2×A4 only',
-                'layout': {'a4': 2},
-                'description': 'Pure A4 efficiency',
-                'priority': 8
-            },
-            {
-                'name': '4×A5 only',
-                'layout': {'a5': 4},
-                'description': 'Pure A5 efficiency',
-                'priority': 8
-            },
-            {
-                'name': '8×A6 only',
-                'layout': {'a6': 8},
-                'description': 'Pure A6 efficiency',
-                'priority': 8
-            },
-            
-            # Medium efficiency mixed combinations (70-85% utilization)
-            {
-                'name': '1×A5 + 3×A6 + 6×100x70',
-                'layout': {'a5': 1, 'a6': 3, '100x70': 6},
-                'description': 'Balanced small size mix',
-                'priority': 7
-            },
-            {
-                'name': '1×A4 + 6×95x95',
-                'layout': {'a4': 1, '95x95': 6},
-                'description': 'A4 with square formats',
-                'priority': 7
-            },
-            {
-                'name': '2×A5 + 8×95x95',
-                'layout': {'a5': 2, '95x95': 8},
-                'description': 'A5 with square formats',
-                'priority': 7
-            },
-            {
-                'name': '1×295x100 + 2×A6 + 6×60x60',
-                'layout': {'295x100': 1, 'a6': 2, '60x60': 6},
-                'description': 'Large format with small items',
-                'priority': 6
-            },
-            {
-                'name': '1×290x140 + 1×A6 + 4×100x70',
-                'layout': {'290x140': 1, 'a6': 1, '100x70': 4},
-                'description': 'Large format mixed',
-                'priority': 6
-            },
-            
-            # Small format high-density options - BOOSTED for consolidation
-            {
-                'name': 'Max 100x70 only',
-                'layout': {'100x70': 40},  # Will be calculated by fit algorithm
-                'description': 'Maximum small format density',
-                'priority': 12,  # INCREASED for better consolidation
-                'utilization': 0.88  # Added utilization for scoring
-            },
-            {
-                'name': 'Max 95x95 only',
-                'layout': {'95x95': 28},  # Will be calculated by fit algorithm  
-                'description': 'Maximum square format density',
-                'priority': 12  # INCREASED for better consolidation
-            },
-            {
-                'name': 'Max 60x60 only',
-                'layout': {'60x60': 72},  # Will be calculated by fit algorithm
-                'description': 'Maximum tiny format density',
-                'priority': 11  # INCREASED for better consolidation
-            },
-            
-            # Specialty combinations for unusual mixes
-            {
-                'name': '2×295x100 only',
-                'layout': {'295x100': 2},
-                'description': 'Large format pair',
-                'priority': 5
-            },
-            {
-                'name': '1×A4 + 1×A6 + 2×295x100',
-                'layout': {'a4': 1, 'a6': 1, '295x100': 2},
-                'description': 'Mixed with large formats',
-                'priority': 5
-            }
-        ]
-        
-        # Calculate dynamic utilization and filter feasible templates
-        feasible_templates = []
-        for template in templates:
-            utilization = self._calculate_template_utilization(template['layout'])
-            if utilization > 0 and utilization <= 1.0:  # Must be physically feasible
-                template['utilization'] = utilization
-                feasible_templates.append(template)
-        
-        return feasible_templates
+        # Feasibility and utilization are resolved once at import - hand out copies of each template
+        # and its layout dict so callers can't mutate the module-level templates
+        return [dict(template, layout=dict(template['layout'])) for template in FEASIBLE_MIXED_TEMPLATES]
     
     def _calculate_template_utilization(self, layout):
         """Calculate utilization using no-rotation bin-packing on 310×438mm sheet"""
-        # Use simple shelf packing algorithm (no rotation allowed)
-        items_to_place = []
-        for size, quantity in layout.items():
-            item_w, item_h = get_size_dims_mm(size)
-            if item_w <= 0 or item_h <= 0:
-                return 0  # Invalid size
-            for _ in range(quantity):
-                items_to_place.append((item_w, item_h))
-        
-        # Sort items by height (tallest first) for better shelf packing
-        items_to_place.sort(key=lambda x: x[1], reverse=True)
-        
-        # Shelf packing without gutters (bleed included in crop dimensions)
-        gutter_x, gutter_y = 0, 0
-        shelves = []  # [(current_width, shelf_height)]
-        total_used_area = 0
-        
-        for item_w, item_h in items_to_place:
-            placed = False
-            
-            # Try to place on existing shelf
-            for i, (shelf_width, shelf_height) in enumerate(shelves):
-                # Check if item fits on this shelf
-                if (shelf_width + gutter_x + item_w <= SHEET_W_MM and 
-                    item_h <= shelf_height):
-                    shelves[i] = (shelf_width + gutter_x + item_w, shelf_height)
-                    total_used_area += item_w * item_h
-                    placed = True
-                    break
-            
-            if not placed:
-                # Create new shelf
-                new_shelf_y = sum(s[1] + gutter_y for s in shelves)
-                if new_shelf_y + item_h <= SHEET_H_MM and item_w <= SHEET_W_MM:
-                    shelves.append((item_w, item_h))
-                    total_used_area += item_w * item_h
-                    placed = True
-            
-            if not placed:
-                return 0  # Cannot fit all items
-        
-        # Calculate utilization based on placed area
-        utilization = total_used_area / SHEET_AREA_MM2
-        return utilization if utilization <= 1.0 else 0
+        return layout_utilization(tuple(layout.items()))
     
     def _find_single_size_combination(self, available_tasks):
         """Fallback to single-size combinations when mixed templates don't work"""
@@ -684,12 +744,12 @@ class TransferGangingEngine(models.Model):
                 continue
             
             # Get max capacity for this size
-            max_fit = task_list[0]['task']._get_fits_on_a3(size)
+            max_fit = get_fits_on_a3(size)
             if max_fit <= 0:
                 continue
             
-            # Sort by priority
-            sorted_tasks = sorted(task_list, key=lambda x: -x['priority'])
+            # Highest priority first - every entry has at least 1 available, so at most max_fit get used
+            sorted_tasks = heapq.nlargest(max_fit, task_list, key=lambda x: x['priority'])
             
             combination = []
             qty_allocated = 0
@@ -699,7 +759,9 @@ class TransferGangingEngine(models.Model):
                 if qty_allocated >= max_fit:
                     break
                 
-                qty_to_take = min(task_item['remaining_qty'], max_fit - qty_allocated)
+                qty_to_take = max_fit - qty_allocated
+                if task_item['remaining_qty'] < qty_to_take:
+                    qty_to_take = task_item['remaining_qty']
                 if qty_to_take > 0:
                     combination.append({
                         'task': task_item['task'],
@@ -719,7 +781,7 @@ class TransferGangingEngine(models.Model):
         
         return best_combination
     
-    def _should_gang_combination(self, combination):
+    def _should_gang_combination(self, combination, task_index=None, gang_priorities=None):
         """Determine if a combination should be ganged based on cost and deadlines"""
         if not combination:
             return False
@@ -739,23 +801,28 @@ class TransferGangingEngine(models.Model):
                 total_quantity += item.get_remaining_quantity()
         
         # Gang if any task has critical deadline
-        if any(t.get_gang_priority() >= 100 for t in tasks):
+        if gang_priorities is None:
+            if any(t.get_gang_priority() >= 100 for t in tasks):
+                return True
+        elif any(gang_priorities[task_index[t.id]] >= 100 for t in tasks):
             return True
         
         # Calculate per-sheet costs
         if not tasks:
             return False
         
-        # Use project cost settings for cost effectiveness
-        first_task = tasks[0]
-        project = first_task.project_id
+        # Use project cost settings for cost effectiveness, read once per project
+        gang_costs_by_project = {}
         
         # Calculate if this combination is cost effective
         cost_effective_count = 0
         for task in tasks:
             size = task.get_parsed_transfer_size()
             quantity = task.get_parsed_quantity()
-            if task.is_cost_effective_to_gang(size, quantity):
+            gang_costs = gang_costs_by_project.get(task.project_id.id)
+            if gang_costs is None:
+                gang_costs = gang_costs_by_project[task.project_id.id] = task._get_gang_costs()
+            if task.is_cost_effective_to_gang(size, quantity, gang_costs):
                 cost_effective_count += 1
         
         # Gang if majority of tasks are cost effective
@@ -769,118 +836,104 @@ class TransferGangingEngine(models.Model):
         ], order='name')
         
         # Sort stages properly: LAY-A1 to LAY-Z1, then LAY-A2 to LAY-Z2
-        def sort_lay_stages(stage):
-            name = stage.name or ''
-            if 'LAY-' in name:
-                parts = name.split('-')
-                if len(parts) >= 2:
-                    suffix = parts[1]
-                    if len(suffix) >= 2:
-                        letter = suffix[0]
-                        number = suffix[1:]
-                        try:
-                            return (int(number), ord(letter.upper()))
-                        except (ValueError, TypeError):
-                            pass
-            return (999, 999)  # Sort unknown formats to end
-        
-        sorted_stages = sorted(lay_stages, key=sort_lay_stages)
+        # Sort on precomputed (row number, column letter) keys, cached per stage name
+        keyed_stages = []
+        for stage in lay_stages:
+            keyed_stages.append((_lay_stage_sort_key(stage.name or ''), stage))
+        keyed_stages.sort(key=lambda keyed: keyed[0])
+        sorted_stages = [stage for _, stage in keyed_stages]
+        
+        # Count tasks per LAY column in a single grouped query
+        task_counts = self.env['project.task'].read_group([
+            ('stage_id', 'in', lay_stages.ids)
+        ], ['stage_id'], ['stage_id'])
+        count_by_stage = {group['stage_id'][0]: group['stage_id_count'] for group in task_counts if group['stage_id']}
         
         # Filter to only available LAY columns (not overloaded)
         available_stages = []
         for stage in sorted_stages:
-            task_count = self.env['project.task'].search_count([
-                ('stage_id', '=', stage.id)
-            ])
             # Allow more tasks per LAY column but still have a reasonable limit
-            if task_count < 20:
+            if count_by_stage.get(stage.id, 0) < 20:
                 available_stages.append(stage)
         
         return available_stages
     
-    def _finalize_task_assignments_with_lay_mapping(self, run_allocations, lay_assignments):
+    def _finalize_task_assignments_with_lay_mapping(self, run_allocations, lay_assignments, task_index, remaining_qtys,
+                                                    lay_stage_ids):
         """Move fully consumed tasks to LAY stages using the LAY assignment mapping to preserve consolidation"""
         if not run_allocations:
             return 0
         
         assigned_count = 0
         processed_task_ids = set()
+        # Stage moves are collected per LAY stage and written in one batch per stage
+        stage_assignments = defaultdict(list)  # lay_stage_id -> [task_id, ...]
+        assigned_task_ids = set()
+        
+        # Single completion pass over the allocation arrays - only move to LAY if fully consumed
+        fully_consumed_ids = {
+            task_id for task_id, task_idx in task_index.items()
+            if run_allocations[task_idx] > 0 and run_allocations[task_idx] >= remaining_qtys[task_idx]
+        }
         
         # First: Process tasks by LAY assignment mapping to preserve consolidation
         if lay_assignments:
+            # One existence check per model instead of one query per assignment
+            mapped_task_ids = {assignment['task_id'] for task_assignments in lay_assignments.values() for assignment in task_assignments}
+            existing_task_ids = set(self.env['project.task'].browse(list(mapped_task_ids)).exists().ids)
+            existing_stage_ids = set(self.env['project.task.type'].browse(list(lay_assignments)).exists().ids)
+            
             for lay_stage_id, task_assignments in lay_assignments.items():
-                lay_stage = self.env['project.task.type'].browse(lay_stage_id)
-                if not lay_stage.exists():
+                if lay_stage_id not in existing_stage_ids:
                     continue
+                lay_stage = self.env['project.task.type'].browse(lay_stage_id)
                     
                 for assignment in task_assignments:
                     task_id = assignment['task_id']
                     processed_task_ids.add(task_id)
                     
-                    task = self.env['project.task'].browse(task_id)
-                    if not task.exists():
+                    # Only move to LAY if the task is substantially or fully consumed
+                    if task_id not in fully_consumed_ids:
                         continue
-                        
-                    remaining_qty = task.get_remaining_quantity()
-                    total_allocated = run_allocations.get(task_id, 0)
                     
-                    # Only move to LAY if the task is substantially or fully consumed
-                    if total_allocated >= remaining_qty:
-                        # Only assign to LAY stage if not already in one
-                        current_stage_name = task.stage_id.name or '' if task.stage_id else ''
-                        if 'LAY' not in current_stage_name:
-                            task.stage_id = lay_stage.id
-                            assigned_count += 1
-                            _logger.info(f"Task {task.name} assigned to LAY stage {lay_stage.name} via consolidated mapping")
-        
-        # Fallback: Process any remaining fully consumed tasks from run_allocations
-        lay_stages = self._get_lay_stages()
-        lay_stage_index = 0
-        for task_id, allocated_qty in run_allocations.items():
-            if task_id not in processed_task_ids and allocated_qty > 0:
-                task = self.env['project.task'].browse(task_id)
-                remaining_qty = task.get_remaining_quantity()
-                
-                # Only move to LAY if the task is substantially or fully consumed
-                if allocated_qty >= remaining_qty:
+                    # Already moved by an earlier LAY assignment of this run
+                    if task_id in assigned_task_ids:
+                        continue
+                    
+                    if task_id not in existing_task_ids:
+                        continue
+                    task = self.env['project.task'].browse(task_id)
+                    
                     # Only assign to LAY stage if not already in one
-                    current_stage_name = task.stage_id.name or '' if task.stage_id else ''
-                    if 'LAY' not in current_stage_name and lay_stage_index < len(lay_stages):
-                        task.stage_id = lay_stages[lay_stage_index].id
-                        lay_stage_index += 1
+                    if task.stage_id.id not in lay_stage_ids:
+                        stage_assignments[lay_stage.id].append(task_id)
+                        assigned_task_ids.add(task_id)
                         assigned_count += 1
-                        _logger.info(f"Task {task.name} assigned to LAY stage {lay_stages[lay_stage_index-1].name} via fallback")
+                        _logger.info(f"Task {task.name} assigned to LAY stage {lay_stage.name} via consolidated mapping")
         
-        return assigned_count
-    
-    def _finalize_task_assignments(self, run_allocations):
-        """Move fully consumed tasks to LAY stages and return count"""
-        fully_ganged_count = 0
+        # Flush before the fallback so its LAY column load counts include the moves above
+        self._write_stage_assignments(stage_assignments)
+        stage_assignments = defaultdict(list)
         
-        # Get available LAY stages for assignment
+        # Fallback: Process any remaining fully consumed tasks from run_allocations
         lay_stages = self._get_lay_stages()
         lay_stage_index = 0
-        
-        # Process run_allocations parameter
-        if not run_allocations:
-            return 0
-            
-        for task_id, allocated_qty in run_allocations.items():
-            if allocated_qty > 0:
+        for task_id in task_index:
+            if task_id not in processed_task_ids and task_id in fully_consumed_ids:
                 task = self.env['project.task'].browse(task_id)
-                remaining_qty = task.get_remaining_quantity()
                 
-                # If task is fully consumed, move to LAY stage
-                if allocated_qty >= remaining_qty:
-                    # Only assign to LAY stage if not already in one
-                    current_stage_name = task.stage_id.name or '' if task.stage_id else ''
-                    if 'LAY' not in current_stage_name:
-                        # Assign to next available LAY stage
-                        if lay_stage_index < len(lay_stages):
-                            task.stage_id = lay_stages[lay_stage_index].id
-                            lay_stage_index += 1
-                            _logger.info(f"Task {task.name} moved to LAY stage {lay_stages[lay_stage_index-1].name}")
-                    
-                    fully_ganged_count += 1
-        
-        return fully_ganged_count
\ No newline at end of file
+                # Only assign to LAY stage if not already in one
+                if task.stage_id.id not in lay_stage_ids and lay_stage_index < len(lay_stages):
+                    stage_assignments[lay_stages[lay_stage_index].id].append(task_id)
+                    lay_stage_index += 1
+                    assigned_count += 1
+                    _logger.info(f"Task {task.name} assigned to LAY stage {lay_stages[lay_stage_index-1].name} via fallback")
+        
+        self._write_stage_assignments(stage_assignments)
+        return assigned_count
+    
+    def _write_stage_assignments(self, stage_assignments):
+        """Apply collected stage moves with one write per target stage, without mail tracking"""
+        tasks_model = self.env['project.task'].with_context(tracking_disable=True, mail_notrack=True, mail_create_nolog=True)
+        for stage_id, task_ids in stage_assignments.items():
+            tasks_model.browse(task_ids).write({'stage_id': stage_id})
\ No newline at end of file
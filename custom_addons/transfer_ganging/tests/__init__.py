@@ -0,0 +1 @@
+from . import test_lay_stage_sort
@@ -0,0 +1,17 @@
+from odoo.tests.common import BaseCase
+from odoo.addons.transfer_ganging.models.ganging_engine import _lay_stage_sort_key
+
+
+class TestLayStageSort(BaseCase):
+    def test_lay_stage_sort_key(self):
+        """LAY-A1 to LAY-Z1, then LAY-A2 to LAY-Z2, unknown formats last"""
+        self.assertEqual(_lay_stage_sort_key('LAY-A1'), (1, ord('A')))
+        self.assertEqual(_lay_stage_sort_key('LAY-A1 '), (1, ord('A')))  # Stray whitespace from the UI
+        self.assertEqual(_lay_stage_sort_key('LAY-B2-x'), (2, ord('B')))
+        self.assertEqual(_lay_stage_sort_key('LAY-AA'), (999, 999))
+        self.assertEqual(_lay_stage_sort_key('New Orders'), (999, 999))
+
+    def test_lay_stage_order(self):
+        """Rows fill left to right before moving on to the next row"""
+        names = ['LAY-B2', 'LAY-AA', 'LAY-A2', 'LAY-B1', 'LAY-A1 ']
+        self.assertEqual(sorted(names, key=_lay_stage_sort_key), ['LAY-A1 ', 'LAY-B1', 'LAY-A2', 'LAY-B2', 'LAY-AA'])
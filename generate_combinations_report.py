@@ -6,6 +6,8 @@ This script generates a comprehensive analysis of all possible transfer ganging
 using the same geometric validation logic from the Odoo module.
 """
 
+import functools
+import heapq
 import itertools
 import sys
 
@@ -25,6 +27,12 @@ SIZE_DIMS = {
     '290x140': (309, 146),     # 290×140 crop=309×146
 }
 
+# Per-size columns indexed by an integer size id, for the hot enumeration loops
+SIZE_NAMES = list(SIZE_DIMS)
+SIZE_WIDTHS = [SIZE_DIMS[size][0] for size in SIZE_NAMES]
+SIZE_HEIGHTS = [SIZE_DIMS[size][1] for size in SIZE_NAMES]
+SIZE_AREAS = [width * height for width, height in zip(SIZE_WIDTHS, SIZE_HEIGHTS)]
+
 def get_size_dims_mm(size):
     """Get dimensions (width, height) in mm for any transfer size"""
     return SIZE_DIMS.get(size, (0, 0))
@@ -45,71 +53,143 @@ def get_fits_on_a3_single(size):
     
     return across * down
 
-def calculate_template_utilization(layout):
-    """Calculate utilization using no-rotation bin-packing on 310×440mm sheet"""
-    # Use simple shelf packing algorithm (no rotation allowed)
-    items_to_place = []
-    for size, quantity in layout.items():
-        item_w, item_h = get_size_dims_mm(size)
-        if item_w <= 0 or item_h <= 0:
-            return 0  # Invalid size
-        for _ in range(quantity):
-            items_to_place.append((item_w, item_h))
-    
-    # Sort items by height (tallest first) for better shelf packing
-    items_to_place.sort(key=lambda x: x[1], reverse=True)
+# The packer works in hundredths of a mm, where every size is a whole number, so all shelf
+# and area arithmetic stays on integers
+PACK_SCALE = 100
+SHEET_W_PACK = SHEET_W_MM * PACK_SCALE
+SHEET_H_PACK = SHEET_H_MM * PACK_SCALE
+SHEET_AREA_PACK = SHEET_W_PACK * SHEET_H_PACK
+SIZE_DIMS_PACK = {size: (round(width * PACK_SCALE), round(height * PACK_SCALE))
+                  for size, (width, height) in SIZE_DIMS.items()}
+SIZE_AREAS_PACK = [SIZE_DIMS_PACK[size][0] * SIZE_DIMS_PACK[size][1] for size in SIZE_NAMES]  # by size id
+
+def shelf_pack(widths, heights):
+    """
+    Shelf-pack items given as parallel width/height columns in PACK_SCALE units, already sorted tallest first
     
+    Returns (sheet utilization, placed item area in mm²), (0, 0) if not all items fit.
+    """
     # Shelf packing without gutters (bleed included in crop dimensions)
     gutter_x, gutter_y = 0, 0
-    shelves = []  # [(current_width, shelf_height)]
+    # Shelves as parallel columns, widths grow in place as items are added
+    shelf_widths = []  # current width of each shelf
+    shelf_heights = []  # height of each shelf
+    used_height = 0  # total height of the shelves (with gutters) so far
     total_used_area = 0
     
-    for item_w, item_h in items_to_place:
+    for item_w, item_h in zip(widths, heights):
         placed = False
         
+        # Bail out before scanning the shelves when the item can neither open a new shelf
+        # nor fit beside the narrowest existing one
+        if (used_height + item_h > SHEET_H_PACK or item_w > SHEET_W_PACK) and \
+                min(shelf_widths, default=SHEET_W_PACK) + gutter_x + item_w > SHEET_W_PACK:
+            return 0, 0  # Cannot fit all items
+        
         # Try to place on existing shelf
-        for i, (shelf_width, shelf_height) in enumerate(shelves):
+        for i in range(len(shelf_widths)):
             # Check if item fits on this shelf
-            if (shelf_width + gutter_x + item_w <= SHEET_W_MM and 
-                item_h <= shelf_height):
-                shelves[i] = (shelf_width + gutter_x + item_w, shelf_height)
+            if (shelf_widths[i] + gutter_x + item_w <= SHEET_W_PACK and 
+                item_h <= shelf_heights[i]):
+                shelf_widths[i] += gutter_x + item_w
                 total_used_area += item_w * item_h
                 placed = True
                 break
         
         if not placed:
             # Create new shelf
-            new_shelf_y = sum(s[1] + gutter_y for s in shelves)
-            if new_shelf_y + item_h <= SHEET_H_MM and item_w <= SHEET_W_MM:
-                shelves.append((item_w, item_h))
+            new_shelf_y = used_height
+            if new_shelf_y + item_h <= SHEET_H_PACK and item_w <= SHEET_W_PACK:
+                shelf_widths.append(item_w)
+                shelf_heights.append(item_h)
+                used_height += item_h + gutter_y
                 total_used_area += item_w * item_h
                 placed = True
         
         if not placed:
-            return 0  # Cannot fit all items
+            return 0, 0  # Cannot fit all items
     
     # Calculate utilization based on placed area
-    utilization = total_used_area / SHEET_AREA_MM2
-    return utilization if utilization <= 1.0 else 0
+    utilization = total_used_area / SHEET_AREA_PACK
+    return (utilization, total_used_area / PACK_SCALE ** 2) if utilization <= 1.0 else (0, 0)
+
+def calculate_template_utilization(layout):
+    """Calculate utilization using no-rotation bin-packing on 310×440mm sheet"""
+    return layout_packing(tuple(layout.items()))[0]
+
+@functools.lru_cache(maxsize=None)
+def layout_packing(layout_items):
+    """
+    Pack a layout given as a tuple of (size, quantity) pairs into (utilization, placed item area),
+    (0, 0) if not feasible
+    
+    The packer is deterministic, so repeated layouts are only packed once. The pair order is part of
+    the key because it decides placement order between equally tall items.
+    """
+    # Use simple shelf packing algorithm (no rotation allowed)
+    items_to_place = []
+    total_area = 0
+    for size, quantity in layout_items:
+        item_w, item_h = SIZE_DIMS_PACK.get(size, (0, 0))
+        if item_w <= 0 or item_h <= 0:
+            return 0, 0  # Invalid size
+        total_area += quantity * item_w * item_h
+        for _ in range(quantity):
+            items_to_place.append((item_w, item_h))
+    
+    # More item area than the sheet can never pack - skip the sort and the packer
+    if total_area > SHEET_AREA_PACK:
+        return 0, 0
+    
+    # Sort items by height (tallest first) for better shelf packing
+    items_to_place.sort(key=lambda x: x[1], reverse=True)
+    
+    # The packer works on plain width/height columns
+    widths = [item_w for item_w, _ in items_to_place]
+    heights = [item_h for _, item_h in items_to_place]
+    return shelf_pack(widths, heights)
+
+def iter_area_bounded_quantities(quantity_ranges, item_areas, max_area=SHEET_AREA_PACK):
+    """
+    Yield the quantity tuples of itertools.product(*quantity_ranges), in the same order, whose total item
+    area fits in max_area (item areas in the same units, integer PACK_SCALE units by default)
+    
+    A branch is pruned as soon as the area chosen so far plus the smallest quantities of the remaining
+    sizes no longer fits, so hopeless tuples are never built.
+    """
+    # Smallest area still needed by the sizes from each position onwards
+    min_tail_areas = [0] * (len(item_areas) + 1)
+    for i in range(len(item_areas) - 1, -1, -1):
+        min_tail_areas[i] = min_tail_areas[i + 1] + min(quantity_ranges[i]) * item_areas[i]
+    
+    def extend(i, used_area, prefix):
+        if i == len(item_areas):
+            yield prefix
+            return
+        for qty in quantity_ranges[i]:
+            area = used_area + qty * item_areas[i]
+            if area + min_tail_areas[i + 1] <= max_area:
+                yield from extend(i + 1, area, prefix + (qty,))
+    
+    return extend(0, 0, ())
 
 def analyze_single_size_combinations():
     """Analyze maximum quantities for each size individually"""
     single_combinations = []
     
-    # Get all available sizes
-    available_sizes = list(SIZE_DIMS.keys())
-    
-    for size in available_sizes:
-        max_qty = get_fits_on_a3_single(size)
-        item_w, item_h = get_size_dims_mm(size)
-        item_area = item_w * item_h
-        total_area = max_qty * item_area
-        utilization = total_area / SHEET_AREA_MM2 if max_qty > 0 else 0
+    for size_id, size in enumerate(SIZE_NAMES):
+        item_w, item_h = SIZE_WIDTHS[size_id], SIZE_HEIGHTS[size_id]
         
-        # Calculate layout pattern
-        across = max(1, int(SHEET_W_MM // item_w)) if item_w > 0 else 0
-        down = max(1, int(max_qty / across)) if across > 0 else 0
-        layout_pattern = f"{across}×{down}" if across * down == max_qty else f"~{across}×{down}"
+        # Same grid as get_fits_on_a3_single, kept so the layout pattern is exactly across × down
+        if 0 < item_w <= SHEET_W_MM and 0 < item_h <= SHEET_H_MM:
+            across = int(SHEET_W_MM // item_w)
+            down = int(SHEET_H_MM // item_h)
+        else:
+            across = down = 0
+        max_qty = across * down
+        total_area = max_qty * SIZE_AREAS[size_id]
+        utilization = total_area / SHEET_AREA_MM2 if max_qty > 0 else 0
+        layout_pattern = f"{across}×{down}"
         
         combination = {
             'size': size,
@@ -128,77 +208,76 @@ def analyze_single_size_combinations():
     
     return single_combinations
 
+def get_quantity_range(max_for_size):
+    """Get the quantities to try for a size in mixed combinations, deduplicated so no layout is listed twice"""
+    if max_for_size <= 2:
+        return [1, 2] if max_for_size >= 2 else [1]
+    elif max_for_size <= 8:
+        return sorted({1, 2, max_for_size//2, max_for_size})
+    else:
+        return sorted({1, 2, 4, max_for_size//2, max_for_size})
+
 def generate_mixed_combinations():
     """Generate and test mixed-size combinations"""
-    mixed_combinations = []
-    available_sizes = list(SIZE_DIMS.keys())
+    mixed_combinations = []  # (utilization_percent, size_combo, quantities, total_area_used) of each layout over 70% utilization
+    available_sizes = range(len(SIZE_NAMES))  # size ids, names are only looked up for the layout key
+    
+    # Generate reasonable quantities per size once, every size combination reuses them
+    size_quantity_ranges = [get_quantity_range(min(12, get_fits_on_a3_single(size))) for size in SIZE_NAMES]
     
     # Test combinations with 2-4 different sizes
     for num_sizes in range(2, 5):
-        size_combinations = list(itertools.combinations(available_sizes, num_sizes))
-        
-        for size_combo in size_combinations:
-            # Generate reasonable quantity combinations
-            max_quantities = {}
-            for size in size_combo:
-                max_quantities[size] = min(12, get_fits_on_a3_single(size))
-            
-            # Create quantity ranges
-            quantity_ranges = []
-            for size in size_combo:
-                max_for_size = max_quantities[size]
-                if max_for_size <= 2:
-                    ranges = [1, 2] if max_for_size >= 2 else [1]
-                elif max_for_size <= 8:
-                    ranges = [1, 2, max_for_size//2, max_for_size]
-                else:
-                    ranges = [1, 2, 4, max_for_size//2, max_for_size]
-                quantity_ranges.append(ranges)
+        for size_combo in itertools.combinations(available_sizes, num_sizes):
+            combo_names = [SIZE_NAMES[size_id] for size_id in size_combo]
+            quantity_ranges = [size_quantity_ranges[size_id] for size_id in size_combo]
+            # Same integer PACK_SCALE areas and sheet bound that layout_packing checks
+            item_areas = [SIZE_AREAS_PACK[size_id] for size_id in size_combo]
             
-            # Generate all combinations
-            for quantities in itertools.product(*quantity_ranges):
-                layout = dict(zip(size_combo, quantities))
-                
+            # Generate all combinations - layouts needing more area than the sheet can never pack
+            for quantities in iter_area_bounded_quantities(quantity_ranges, item_areas):
                 # Test feasibility
-                utilization = calculate_template_utilization(layout)
+                utilization, total_area_used = layout_packing(tuple(zip(combo_names, quantities)))
                 if utilization > 0:
-                    total_items = sum(layout.values())
-                    total_area_used = sum(
-                        get_size_dims_mm(size)[0] * get_size_dims_mm(size)[1] * qty
-                        for size, qty in layout.items()
-                    )
-                    
-                    # Format description
-                    parts = []
-                    for size, qty in sorted(layout.items()):
-                        size_display = size.upper() if size.startswith('a') else size.replace('x', '×')
-                        parts.append(f"{qty}×{size_display}")
-                    description = " + ".join(parts)
-                    
-                    combination = {
-                        'layout': layout.copy(),
-                        'description': description,
-                        'total_items': total_items,
-                        'total_area_used': total_area_used,
-                        'utilization_percent': round(utilization * 100, 1),
-                        'waste_area': SHEET_AREA_MM2 - total_area_used,
-                    }
-                    
-                    mixed_combinations.append(combination)
-    
-    # Filter to combinations with >70% utilization and sort by utilization
-    high_util = [c for c in mixed_combinations if c['utilization_percent'] >= 70]
-    high_util.sort(key=lambda x: x['utilization_percent'], reverse=True)
-    
-    return high_util[:100]  # Top 100 combinations
+                    # Filter to combinations with >70% utilization as they are found
+                    utilization_percent = round(utilization * 100, 1)
+                    if utilization_percent >= 70:
+                        mixed_combinations.append((utilization_percent, size_combo, quantities, total_area_used))
+    
+    # Select the top 100 by utilization - same order as a stable descending sort
+    high_util = heapq.nlargest(100, mixed_combinations, key=lambda x: x[0])
+    
+    # Only the top 100 combinations are reported, so only those get their layout and description built
+    top_combinations = []
+    for utilization_percent, size_combo, quantities, total_area_used in high_util:
+        layout = {SIZE_NAMES[size_id]: qty for size_id, qty in zip(size_combo, quantities)}
+        total_items = sum(quantities)
+        
+        # Format description
+        parts = []
+        for size, qty in sorted(layout.items()):
+            size_display = size.upper() if size.startswith('a') else size.replace('x', '×')
+            parts.append(f"{qty}×{size_display}")
+        description = " + ".join(parts)
+        
+        top_combinations.append({
+            'layout': layout,
+            'description': description,
+            'total_items': total_items,
+            'total_area_used': total_area_used,
+            'utilization_percent': utilization_percent,
+            'waste_area': SHEET_AREA_MM2 - total_area_used,
+        })
+    
+    return top_combinations
 
 def generate_report():
     """Generate comprehensive combination analysis report"""
-    print("=" * 80)
-    print("TRANSFER GANGING COMBINATION ANALYSIS REPORT")
-    print("=" * 80)
-    print(f"Sheet Dimensions: {SHEET_W_MM}×{SHEET_H_MM}mm ({SHEET_AREA_MM2:,} mm²)")
-    print("")
+    lines = []  # Collected and written in one go at the end
+    lines.append("=" * 80)
+    lines.append("TRANSFER GANGING COMBINATION ANALYSIS REPORT")
+    lines.append("=" * 80)
+    lines.append(f"Sheet Dimensions: {SHEET_W_MM}×{SHEET_H_MM}mm ({SHEET_AREA_MM2:,} mm²)")
+    lines.append("")
     
     # Analyze single-size combinations
     single_combos = analyze_single_size_combinations()
@@ -210,62 +289,64 @@ def generate_report():
     single_utilizations = [c['utilization_percent'] for c in single_combos if c['max_quantity'] > 0]
     mixed_utilizations = [c['utilization_percent'] for c in mixed_combos]
     
-    print("SUMMARY STATISTICS")
-    print("-" * 40)
-    print(f"Total Single-Size Combinations: {len(single_combos)}")
-    print(f"Total Mixed-Size Combinations: {len(mixed_combos)}")
-    print(f"Highest Single Utilization: {max(single_utilizations):.1f}%" if single_utilizations else "N/A")
-    print(f"Highest Mixed Utilization: {max(mixed_utilizations):.1f}%" if mixed_utilizations else "N/A")
-    print(f"Average Single Utilization: {sum(single_utilizations)/len(single_utilizations):.1f}%" if single_utilizations else "N/A")
-    print(f"Average Mixed Utilization: {sum(mixed_utilizations)/len(mixed_utilizations):.1f}%" if mixed_utilizations else "N/A")
-    print(f"Combinations >90% Utilization: {len([c for c in mixed_combos if c['utilization_percent'] >= 90])}")
-    print(f"Combinations >95% Utilization: {len([c for c in mixed_combos if c['utilization_percent'] >= 95])}")
-    print("")
+    lines.append("SUMMARY STATISTICS")
+    lines.append("-" * 40)
+    lines.append(f"Total Single-Size Combinations: {len(single_combos)}")
+    lines.append(f"Total Mixed-Size Combinations: {len(mixed_combos)}")
+    lines.append(f"Highest Single Utilization: {max(single_utilizations):.1f}%" if single_utilizations else "N/A")
+    lines.append(f"Highest Mixed Utilization: {max(mixed_utilizations):.1f}%" if mixed_utilizations else "N/A")
+    lines.append(f"Average Single Utilization: {sum(single_utilizations)/len(single_utilizations):.1f}%" if single_utilizations else "N/A")
+    lines.append(f"Average Mixed Utilization: {sum(mixed_utilizations)/len(mixed_utilizations):.1f}%" if mixed_utilizations else "N/A")
+    lines.append(f"Combinations >90% Utilization: {len([c for c in mixed_combos if c['utilization_percent'] >= 90])}")
+    lines.append(f"Combinations >95% Utilization: {len([c for c in mixed_combos if c['utilization_percent'] >= 95])}")
+    lines.append("")
     
     # Single-Size Combinations
-    print("SINGLE-SIZE COMBINATIONS")
-    print("-" * 80)
-    print(f"{'Size':<12} {'Dimensions':<15} {'Max Qty':<8} {'Layout':<10} {'Utilization':<12} {'Waste Area'}")
-    print("-" * 80)
+    lines.append("SINGLE-SIZE COMBINATIONS")
+    lines.append("-" * 80)
+    lines.append(f"{'Size':<12} {'Dimensions':<15} {'Max Qty':<8} {'Layout':<10} {'Utilization':<12} {'Waste Area'}")
+    lines.append("-" * 80)
     
     for combo in single_combos:
-        print(f"{combo['size'].upper():<12} {combo['dimensions']:<15} "
-              f"{combo['max_quantity']:<8} {combo['layout_pattern']:<10} "
-              f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
+        lines.append(f"{combo['size'].upper():<12} {combo['dimensions']:<15} "
+                     f"{combo['max_quantity']:<8} {combo['layout_pattern']:<10} "
+                     f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
     
-    print("")
+    lines.append("")
     
     # Top Mixed-Size Combinations
-    print("TOP MIXED-SIZE COMBINATIONS (>95% Utilization)")
-    print("-" * 80)
-    print(f"{'Combination':<40} {'Items':<6} {'Utilization':<12} {'Waste Area'}")
-    print("-" * 80)
+    lines.append("TOP MIXED-SIZE COMBINATIONS (>95% Utilization)")
+    lines.append("-" * 80)
+    lines.append(f"{'Combination':<40} {'Items':<6} {'Utilization':<12} {'Waste Area'}")
+    lines.append("-" * 80)
     
     top_95 = [c for c in mixed_combos if c['utilization_percent'] >= 95][:20]
     for combo in top_95:
-        print(f"{combo['description']:<40} {combo['total_items']:<6} "
-              f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
+        lines.append(f"{combo['description']:<40} {combo['total_items']:<6} "
+                     f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
     
-    print("")
-    print("HIGH-EFFICIENCY MIXED COMBINATIONS (90-95% Utilization)")
-    print("-" * 80)
+    lines.append("")
+    lines.append("HIGH-EFFICIENCY MIXED COMBINATIONS (90-95% Utilization)")
+    lines.append("-" * 80)
     
     high_90 = [c for c in mixed_combos if 90 <= c['utilization_percent'] < 95][:25]
     for combo in high_90:
-        print(f"{combo['description']:<40} {combo['total_items']:<6} "
-              f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
+        lines.append(f"{combo['description']:<40} {combo['total_items']:<6} "
+                     f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
     
-    print("")
-    print("GOOD-EFFICIENCY MIXED COMBINATIONS (80-90% Utilization)")
-    print("-" * 80)
+    lines.append("")
+    lines.append("GOOD-EFFICIENCY MIXED COMBINATIONS (80-90% Utilization)")
+    lines.append("-" * 80)
     
     good_80 = [c for c in mixed_combos if 80 <= c['utilization_percent'] < 90][:30]
     for combo in good_80:
-        print(f"{combo['description']:<40} {combo['total_items']:<6} "
-              f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
+        lines.append(f"{combo['description']:<40} {combo['total_items']:<6} "
+                     f"{combo['utilization_percent']:>6.1f}%     {combo['waste_area']:>8.0f}mm²")
+    
+    lines.append("")
+    lines.append("=" * 80)
     
-    print("")
-    print("=" * 80)
+    sys.stdout.write("\n".join(lines) + "\n")
 
 if __name__ == "__main__":
     generate_report()
\ No newline at end of file